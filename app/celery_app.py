@@ -19,8 +19,20 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
     task_soft_time_limit=25 * 60,  # 25 minutes
-    worker_prefetch_multiplier=1,
+    # Ingestion tasks are I/O-bound (embedding and vector store calls) with highly
+    # variable durations. Run workers with -Ofair and a small prefetch so a worker
+    # keeps one task queued behind the running one without hoarding long tasks
+    # that another idle worker could pick up.
+    worker_prefetch_multiplier=2,
+    task_acks_late=True,
+    worker_disable_rate_limits=True,
     worker_max_tasks_per_child=1000,
+    # Must exceed task_time_limit so late-acked tasks are not redelivered mid-run
+    broker_transport_options={"visibility_timeout": 3600},
+    broker_connection_retry_on_startup=True,
+    # Cap broker and result-backend connections per worker process
+    broker_pool_limit=settings.redis_max_connections,
+    redis_max_connections=settings.redis_max_connections,
 )
 
 # Periodic tasks
@@ -1,17 +1,84 @@
 import asyncio
 import json
 import logging
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 import structlog
-import redis.asyncio as redis
-import hashlib
+import msgpack
+import xxhash
+import struct
 import time
 from datetime import datetime, timedelta
 
 from app.core.config import settings
+from app.core.redis_pool import get_redis_client, open_dedicated_client
 
 logger = structlog.get_logger()
 
+# Cache-key namespaces, with hashers pre-seeded on "<prefix>:" so each key only
+# hashes its variable suffix
+_KEY_PREFIXES = {prefix: f"{prefix}:".encode() for prefix in ("vector", "rerank", "answer")}
+_KEY_HASHERS = {prefix: xxhash.xxh3_128(encoded) for prefix, encoded in _KEY_PREFIXES.items()}
+
+# Module-level bindings for the per-request (de)serialization hot paths
+_packb = msgpack.packb
+_unpackb = msgpack.unpackb
+_dumps = json.dumps
+_pack_score = struct.Struct('<d').pack
+_unpack_score = struct.Struct('<d').unpack
+
+def _quantize_int8(vector: Any) -> Tuple[bytes, float]:
+    """Symmetrically quantize a vector to int8 bytes plus its float scale"""
+    arr = np.asarray(vector, dtype=np.float32)
+    max_abs = float(np.abs(arr).max()) if arr.size else 0.0
+    scale = max_abs / 127.0 if max_abs > 0 else 1.0
+    return np.round(arr / scale).astype(np.int8).tobytes(), scale
+
+def _dequantize_int8(data: bytes, scale: float) -> np.ndarray:
+    """Restore a float32 vector from int8 bytes and its scale"""
+    return np.frombuffer(data, dtype=np.int8).astype(np.float32) * scale
+
+class LocalTTLCache:
+    """Bounded in-process LRU cache whose entries expire after a fixed TTL"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Get a live entry, refreshing its LRU position"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: Any, value: Any):
+        """Insert an entry, evicting the least recently used one when full"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key: Any):
+        """Drop an entry if present"""
+        self._data.pop(key, None)
+    
+    def clear(self):
+        """Drop all entries"""
+        self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
 class CacheService:
     def __init__(self):
         self.redis_client = None
@@ -19,25 +86,189 @@ class CacheService:
         self.vector_cache_ttl = 7200  # 2 hours for vectors
         self.rerank_cache_ttl = 1800  # 30 minutes for reranking
         self.answer_cache_ttl = 600  # 10 minutes for answers
+        self.invalidation_batch_size = 500  # keys per UNLINK during invalidation
+        
+        # Vector-hit and answer writes are queued and flushed by a background task in
+        # pipelined batches, so request handlers never wait on SETEX
+        self._write_queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+        self._write_batch_size = 256
+        self._write_flush_interval = 0.005  # 5 ms
+        self._flusher_task: Optional[asyncio.Task] = None
+        # Cleared while the flusher holds a dequeued batch that has not landed yet
+        self._writes_idle = asyncio.Event()
+        self._writes_idle.set()
+        
+        # In-process front caches so hot queries skip the Redis round-trip entirely.
+        # Single-threaded under asyncio, so no locking is needed.
+        self._rerank_local = LocalTTLCache(maxsize=100_000, ttl=60)
+        self._vector_local = LocalTTLCache(maxsize=1_000, ttl=60)
+        
+        # Answers are served from local memory while Redis client-side tracking
+        # (BCAST on the answer: prefix) pushes invalidations to this process
+        self._answer_local = LocalTTLCache(maxsize=10_000, ttl=self.answer_cache_ttl)
+        self._answer_tracking_task: Optional[asyncio.Task] = None
+        self._answer_tracking_active = False
+        self._answer_tracking_retry_at = 0.0
+        
         self._initialize_redis()
     
     def _initialize_redis(self):
         """Initialize Redis connection"""
         try:
-            self.redis_client = redis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
+            # Shared pool in binary mode: payloads are msgpack-encoded, scores are packed doubles
+            self.redis_client = get_redis_client()
             logger.info("Redis cache initialized")
         except Exception as e:
             logger.warning(f"Redis not available: {e}")
             self.redis_client = None
     
-    def _generate_cache_key(self, prefix: str, *args) -> str:
-        """Generate cache key from arguments"""
-        key_data = f"{prefix}:{':'.join(str(arg) for arg in args)}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+    def _generate_cache_key(self, prefix: str, *args) -> bytes:
+        """Generate cache key from arguments as a short prefix plus a raw 16-byte digest"""
+        seeded = _KEY_HASHERS.get(prefix)
+        if seeded is None:
+            key_data = f"{prefix}:{':'.join(str(arg) for arg in args)}"
+            return f"{prefix}:".encode() + xxhash.xxh3_128_digest(key_data.encode())
+        
+        hasher = seeded.copy()
+        hasher.update(':'.join(str(arg) for arg in args).encode())
+        return _KEY_PREFIXES[prefix] + hasher.digest()
+    
+    def _collection_index_key(self, collection: str) -> str:
+        """Key of the set tracking every cache entry that belongs to a collection"""
+        return f"cacheindex:{collection}"
+    
+    def _track_collection_key(self, pipe, collection: str, cache_key: bytes, ttl: int):
+        """Queue registration of a cache key in its collection index"""
+        index_key = self._collection_index_key(collection)
+        pipe.sadd(index_key, cache_key)
+        pipe.expire(index_key, max(ttl, self.vector_cache_ttl))
+    
+    def _enqueue_write(self, cache_key: bytes, ttl: int, value: bytes, collection: Optional[str] = None) -> bool:
+        """Queue a SETEX for the background flusher without waiting on Redis"""
+        if self._flusher_task is None or self._flusher_task.done():
+            self._flusher_task = asyncio.get_running_loop().create_task(self._flush_writes())
+        
+        try:
+            self._write_queue.put_nowait((cache_key, ttl, value, collection))
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Cache write queue full, dropping write")
+            return False
+    
+    async def _flush_writes(self):
+        """Drain queued writes into pipelined batches until cancelled"""
+        while True:
+            batch = [await self._write_queue.get()]
+            self._writes_idle.clear()
+            try:
+                # Give concurrent requests a moment to add to the batch
+                await asyncio.sleep(self._write_flush_interval)
+                while len(batch) < self._write_batch_size and not self._write_queue.empty():
+                    batch.append(self._write_queue.get_nowait())
+                
+                await self._execute_writes(batch)
+            finally:
+                self._writes_idle.set()
+    
+    async def _execute_writes(self, batch: List[Tuple[bytes, int, bytes, Optional[str]]]):
+        """Send a batch of queued writes in one non-transactional pipeline"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for cache_key, ttl, value, collection in batch:
+                pipe.setex(cache_key, ttl, value)
+                if collection:
+                    self._track_collection_key(pipe, collection, cache_key, ttl)
+            await pipe.execute()
+            
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} cache writes: {e}")
+    
+    async def flush_pending_writes(self):
+        """Write out everything still in the queue, and wait for the batch in flight"""
+        batch = []
+        while not self._write_queue.empty():
+            batch.append(self._write_queue.get_nowait())
+        
+        if batch and self.redis_client:
+            await self._execute_writes(batch)
+        
+        # The flusher may already have dequeued a batch it is still collecting or sending
+        await self._writes_idle.wait()
+    
+    def _ensure_answer_tracking(self) -> bool:
+        """Start invalidation tracking for answers if needed; True once it is live"""
+        task = self._answer_tracking_task
+        if (task is None or task.done()) and time.monotonic() >= self._answer_tracking_retry_at:
+            self._answer_tracking_task = asyncio.get_running_loop().create_task(
+                self._track_answer_invalidations()
+            )
+        return self._answer_tracking_active
+    
+    async def _track_answer_invalidations(self):
+        """Listen for server-pushed invalidations of answer keys and evict them locally"""
+        # RESP2 delivers tracking invalidations over pub/sub to a redirect connection,
+        # so a pub/sub connection listens and a second one enables broadcast tracking.
+        # Both live in private pools: connections left in SUBSCRIBE or tracking mode
+        # must never be handed back to the shared pool.
+        listener = open_dedicated_client()
+        tracker = open_dedicated_client(single_connection_client=True)
+        pubsub = listener.pubsub()
+        
+        try:
+            # CLIENT ID goes out before SUBSCRIBE, while the connection still
+            # answers ordinary commands
+            await pubsub.execute_command("CLIENT", "ID")
+            listener_id = await pubsub.parse_response(block=True)
+            await pubsub.subscribe("__redis__:invalidate")
+            await tracker.execute_command(
+                "CLIENT", "TRACKING", "ON", "REDIRECT", listener_id,
+                "BCAST", "PREFIX", _KEY_PREFIXES["answer"]
+            )
+            
+            # Anything cached before this (re)connect missed its invalidations
+            self._answer_local.clear()
+            self._answer_tracking_active = True
+            logger.info("Answer cache client-side tracking enabled")
+            
+            # A dropped connection raises out of listen(); tracking is then
+            # restarted from scratch with a fresh connection id
+            async for message in pubsub.listen():
+                # data is the list of invalidated keys, or None on FLUSHDB
+                if message["type"] != "message":
+                    continue
+                if message["data"] is None:
+                    self._answer_local.clear()
+                else:
+                    for key in message["data"]:
+                        self._answer_local.pop(key)
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Answer cache tracking unavailable: {e}")
+            self._answer_tracking_retry_at = time.monotonic() + 30
+        finally:
+            # Without invalidations the local copies can no longer be trusted
+            self._answer_tracking_active = False
+            self._answer_local.clear()
+            await pubsub.aclose()
+            await listener.aclose(close_connection_pool=True)
+            await tracker.aclose(close_connection_pool=True)
+    
+    async def close(self):
+        """Stop background tasks, flush pending writes and close the client"""
+        for task in (self._flusher_task, self._answer_tracking_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        
+        await self.flush_pending_writes()
+        
+        if self.redis_client:
+            await self.redis_client.close()
     
     async def get_vector_hits(self, query: str, collection: str) -> Optional[List[Tuple[Any, float]]]:
         """Get cached vector search results"""
@@ -46,11 +277,17 @@ class CacheService:
         
         try:
             cache_key = self._generate_cache_key("vector", query, collection)
+            local_hits = self._vector_local.get(cache_key)
+            if local_hits is not None:
+                return self._copy_vector_hits(local_hits)
+            
             cached_data = await self.redis_client.get(cache_key)
             
             if cached_data:
                 logger.debug(f"Vector cache hit for query: {query[:50]}...")
-                return json.loads(cached_data)
+                hits = self._decode_vector_hits(_unpackb(cached_data, raw=False))
+                self._vector_local.set(cache_key, hits)
+                return self._copy_vector_hits(hits)
             
             return None
             
@@ -58,6 +295,33 @@ class CacheService:
             logger.error(f"Error getting vector cache: {e}")
             return None
     
+    def _encode_vector_hit(self, doc: Any, score: float) -> Dict[str, Any]:
+        """Build a cacheable vector hit, storing any embedding as int8 bytes"""
+        hit = {
+            "page_content": doc.page_content,
+            "metadata": dict(doc.metadata),
+            "score": score
+        }
+        
+        embedding = doc.metadata.get("embedding")
+        if embedding is not None:
+            del hit["metadata"]["embedding"]
+            hit["embedding_q"], hit["embedding_scale"] = _quantize_int8(embedding)
+        
+        return hit
+    
+    def _copy_vector_hits(self, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fresh hit dicts for a caller, so edits never reach the process-local cache"""
+        return [{**hit, "metadata": dict(hit["metadata"])} for hit in hits]
+    
+    def _decode_vector_hits(self, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Restore dequantized embeddings into cached vector hits"""
+        for hit in hits:
+            embedding_q = hit.pop("embedding_q", None)
+            if embedding_q is not None:
+                hit["metadata"]["embedding"] = _dequantize_int8(embedding_q, hit.pop("embedding_scale"))
+        return hits
+    
     async def set_vector_hits(self, query: str, collection: str, 
                             results: List[Tuple[Any, float]], ttl: Optional[int] = None) -> bool:
         """Cache vector search results"""
@@ -72,20 +336,14 @@ class CacheService:
             serializable_results = []
             for doc, score in results:
                 if hasattr(doc, 'page_content') and hasattr(doc, 'metadata'):
-                    serializable_results.append({
-                        "page_content": doc.page_content,
-                        "metadata": doc.metadata,
-                        "score": score
-                    })
+                    serializable_results.append(self._encode_vector_hit(doc, score))
             
-            await self.redis_client.setex(
-                cache_key, 
-                ttl, 
-                json.dumps(serializable_results, default=str)
-            )
+            payload = _packb(serializable_results, use_bin_type=True, default=str)
+            self._vector_local.set(cache_key, self._decode_vector_hits(serializable_results))
+            queued = self._enqueue_write(cache_key, ttl, payload, collection)
             
             logger.debug(f"Vector cache set for query: {query[:50]}...")
-            return True
+            return queued
             
         except Exception as e:
             logger.error(f"Error setting vector cache: {e}")
@@ -97,12 +355,19 @@ class CacheService:
             return None
         
         try:
-            cache_key = self._generate_cache_key("rerank", query, doc_id)
-            cached_score = await self.redis_client.get(cache_key)
+            # All scores for a query live in one hash, keyed by document ID
+            cache_key = self._generate_cache_key("rerank", query)
+            local_score = self._rerank_local.get((cache_key, doc_id))
+            if local_score is not None:
+                return local_score
+            
+            cached_score = await self.redis_client.hget(cache_key, doc_id)
             
             if cached_score:
                 logger.debug(f"Rerank cache hit for query: {query[:50]}...")
-                return float(cached_score)
+                score = _unpack_score(cached_score)[0]
+                self._rerank_local.set((cache_key, doc_id), score)
+                return score
             
             return None
             
@@ -117,10 +382,15 @@ class CacheService:
             return False
         
         try:
-            cache_key = self._generate_cache_key("rerank", query, doc_id)
+            cache_key = self._generate_cache_key("rerank", query)
             ttl = ttl or self.rerank_cache_ttl
             
-            await self.redis_client.setex(cache_key, ttl, str(score))
+            self._rerank_local.set((cache_key, doc_id), score)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(cache_key, doc_id, _pack_score(score))
+            pipe.expire(cache_key, ttl)
+            await pipe.execute()
             
             logger.debug(f"Rerank cache set for query: {query[:50]}...")
             return True
@@ -129,6 +399,59 @@ class CacheService:
             logger.error(f"Error setting rerank cache: {e}")
             return False
     
+    async def get_rerank_scores(self, query: str, doc_ids: List[str]) -> List[Optional[float]]:
+        """Get cached reranking scores for a batch of documents in one round-trip"""
+        if not self.redis_client or not doc_ids:
+            return [None] * len(doc_ids)
+        
+        try:
+            cache_key = self._generate_cache_key("rerank", query)
+            scores = [self._rerank_local.get((cache_key, doc_id)) for doc_id in doc_ids]
+            
+            # Only go to Redis for the documents the local cache could not answer
+            missing = [i for i, score in enumerate(scores) if score is None]
+            if not missing:
+                return scores
+            
+            cached_scores = await self.redis_client.hmget(cache_key, [doc_ids[i] for i in missing])
+            for i, cached_score in zip(missing, cached_scores):
+                if cached_score:
+                    scores[i] = _unpack_score(cached_score)[0]
+                    self._rerank_local.set((cache_key, doc_ids[i]), scores[i])
+            
+            return scores
+            
+        except Exception as e:
+            logger.error(f"Error getting rerank cache batch: {e}")
+            return [None] * len(doc_ids)
+    
+    async def set_rerank_scores(self, query: str, doc_ids: List[str], scores: List[float],
+                              ttl: Optional[int] = None) -> bool:
+        """Cache reranking scores for a batch of documents in one round-trip"""
+        if not self.redis_client or not doc_ids:
+            return False
+        
+        try:
+            cache_key = self._generate_cache_key("rerank", query)
+            ttl = ttl or self.rerank_cache_ttl
+            
+            for doc_id, score in zip(doc_ids, scores):
+                self._rerank_local.set((cache_key, doc_id), score)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(cache_key, mapping={
+                doc_id: _pack_score(score) for doc_id, score in zip(doc_ids, scores)
+            })
+            pipe.expire(cache_key, ttl)
+            await pipe.execute()
+            
+            logger.debug(f"Rerank cache set for {len(doc_ids)} documents, query: {query[:50]}...")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error setting rerank cache batch: {e}")
+            return False
+    
     async def get_answer(self, query: str, collection: str, filters: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
         """Get cached answer"""
         if not self.redis_client:
@@ -136,14 +459,23 @@ class CacheService:
         
         try:
             # Include filters in cache key
-            filter_str = json.dumps(filters or {}, sort_keys=True)
+            filter_str = _dumps(filters or {}, sort_keys=True)
             cache_key = self._generate_cache_key("answer", query, collection, filter_str)
             
+            tracking = self._ensure_answer_tracking()
+            if tracking:
+                local_answer = self._answer_local.get(cache_key)
+                if local_answer is not None:
+                    return local_answer
+            
             cached_answer = await self.redis_client.get(cache_key)
             
             if cached_answer:
                 logger.debug(f"Answer cache hit for query: {query[:50]}...")
-                return json.loads(cached_answer)
+                answer = _unpackb(cached_answer, raw=False)
+                if tracking:
+                    self._answer_local.set(cache_key, answer)
+                return answer
             
             return None
             
@@ -158,18 +490,19 @@ class CacheService:
             return False
         
         try:
-            filter_str = json.dumps(filters or {}, sort_keys=True)
+            filter_str = _dumps(filters or {}, sort_keys=True)
             cache_key = self._generate_cache_key("answer", query, collection, filter_str)
             ttl = ttl or self.answer_cache_ttl
             
-            await self.redis_client.setex(
+            queued = self._enqueue_write(
                 cache_key, 
                 ttl, 
-                json.dumps(answer, default=str)
+                _packb(answer, use_bin_type=True, default=str),
+                collection
             )
             
             logger.debug(f"Answer cache set for query: {query[:50]}...")
-            return True
+            return queued
             
         except Exception as e:
             logger.error(f"Error setting answer cache: {e}")
@@ -181,13 +514,34 @@ class CacheService:
             return False
         
         try:
-            # Get all keys for the collection
-            pattern = f"*:{collection}:*"
-            keys = await self.redis_client.keys(pattern)
+            # Make sure queued writes land before their keys are invalidated
+            await self.flush_pending_writes()
+            self._vector_local.clear()
+            self._answer_local.clear()
+            
+            # Walk the collection's index set instead of scanning the whole keyspace
+            # with KEYS, and UNLINK in chunks so Redis frees memory in the background
+            index_key = self._collection_index_key(collection)
+            pipe = self.redis_client.pipeline(transaction=False)
+            batch = []
+            invalidated = 0
+            
+            async for key in self.redis_client.sscan_iter(index_key, count=self.invalidation_batch_size):
+                batch.append(key)
+                if len(batch) >= self.invalidation_batch_size:
+                    pipe.unlink(*batch)
+                    invalidated += len(batch)
+                    batch = []
+            
+            if batch:
+                pipe.unlink(*batch)
+                invalidated += len(batch)
+            
+            pipe.unlink(index_key)
+            await pipe.execute()
             
-            if keys:
-                await self.redis_client.delete(*keys)
-                logger.info(f"Invalidated {len(keys)} cache entries for collection: {collection}")
+            if invalidated:
+                logger.info(f"Invalidated {invalidated} cache entries for collection: {collection}")
             
             return True
             
@@ -248,6 +602,9 @@ class CacheService:
         
         try:
             await self.redis_client.flushdb()
+            self._rerank_local.clear()
+            self._vector_local.clear()
+            self._answer_local.clear()
             logger.info("Cleared all cache entries")
             return True
             
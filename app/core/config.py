@@ -1,5 +1,6 @@
 import os
-from typing import Optional
+from functools import lru_cache, cached_property
+from typing import Optional, Tuple
 from pydantic import BaseSettings, Field
 from dotenv import load_dotenv
 
@@ -21,10 +22,20 @@ class Settings(BaseSettings):
     embedding_model: str = Field("text-embedding-3-large", env="EMBEDDING_MODEL")
     embedding_batch_size: int = Field(100, env="EMBEDDING_BATCH_SIZE")
     embedding_dimension: int = Field(3072, env="EMBEDDING_DIMENSION")
+    embedding_concurrency: int = Field(10, env="EMBEDDING_CONCURRENCY")
+    openai_tpm: int = Field(1000000, env="OPENAI_TPM")  # embedding tokens per minute, 0 disables pacing
+    enable_embedding_cache: bool = Field(True, env="ENABLE_EMBEDDING_CACHE")
+    embedding_cache_path: str = Field("./data/embedding_cache.db", env="EMBEDDING_CACHE_PATH")
+    query_embedding_cache_size: int = Field(10000, env="QUERY_EMBEDDING_CACHE_SIZE")
+    embedding_versions_path: str = Field("./data/embedding_versions.json", env="EMBEDDING_VERSIONS_PATH")
+    enable_near_duplicate_cache: bool = Field(False, env="ENABLE_NEAR_DUPLICATE_CACHE")
+    near_duplicate_cache_size: int = Field(10000, env="NEAR_DUPLICATE_CACHE_SIZE")
+    near_duplicate_max_distance: int = Field(3, env="NEAR_DUPLICATE_MAX_DISTANCE")  # SimHash bits out of 64
     
     # Database Configuration
     database_url: str = Field("sqlite:///./rag_system.db", env="DATABASE_URL")
     redis_url: str = Field("redis://localhost:6379/0", env="REDIS_URL")
+    redis_max_connections: int = Field(64, env="REDIS_MAX_CONNECTIONS")
     
     # Celery Configuration
     celery_broker_url: str = Field("redis://localhost:6379/0", env="CELERY_BROKER_URL")
@@ -33,8 +44,12 @@ class Settings(BaseSettings):
     # Application Configuration
     max_file_size_mb: int = Field(100, env="MAX_FILE_SIZE_MB")
     max_concurrent_ingestions: int = Field(10, env="MAX_CONCURRENT_INGESTIONS")
+    # Characters; only the markdown splitter still sizes chunks this way
     chunk_size: int = Field(1000, env="CHUNK_SIZE")
     chunk_overlap: int = Field(200, env="CHUNK_OVERLAP")
+    # Tokens (cl100k_base); sizes text and PDF chunks
+    chunk_size_tokens: int = Field(256, env="CHUNK_SIZE_TOKENS")
+    chunk_overlap_tokens: int = Field(50, env="CHUNK_OVERLAP_TOKENS")
     max_query_results: int = Field(20, env="MAX_QUERY_RESULTS")
     
     # Monitoring
@@ -59,6 +74,7 @@ class Settings(BaseSettings):
     # Guardrails Configuration
     max_tokens: int = Field(4000, env="MAX_TOKENS")
     max_context_tokens: int = Field(8000, env="MAX_CONTEXT_TOKENS")
+    max_prompt_tokens: Optional[int] = Field(None, env="MAX_PROMPT_TOKENS")  # whole prompt; unset = no limit
     require_citations: bool = Field(True, env="REQUIRE_CITATIONS")
     forbid_unverifiable: bool = Field(True, env="FORBID_UNVERIFIABLE")
     min_confidence_threshold: float = Field(0.3, env="MIN_CONFIDENCE_THRESHOLD")
@@ -72,9 +88,23 @@ class Settings(BaseSettings):
     enable_caching: bool = Field(True, env="ENABLE_CACHING")
     cache_ttl: int = Field(3600, env="CACHE_TTL")
     enable_streaming: bool = Field(True, env="ENABLE_STREAMING")
+    content_hash_algorithm: str = Field("blake3", env="CONTENT_HASH_ALGORITHM")  # blake3, sha256
+    # SQLite file shared by all workers for dedup tracking; empty keeps it in-process
+    dedup_index_path: str = Field("", env="DEDUP_INDEX_PATH")
+    
+    @cached_property
+    def allowed_file_types_tuple(self) -> Tuple[str, ...]:
+        """Allowed file extensions, parsed once from the comma-separated setting"""
+        return tuple(ext.strip().lower() for ext in self.allowed_file_types.split(",") if ext.strip())
     
     class Config:
         env_file = ".env"
         case_sensitive = False
+        keep_untouched = (cached_property,)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get the process-wide settings instance (env and .env are parsed once)"""
+    return Settings()
 
-settings = Settings()
+settings = get_settings()
@@ -1,58 +1,305 @@
+import asyncio
+import dataclasses
 import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Set, Tuple
+import os
+import re
+import sqlite3
+import string
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import orjson
 import structlog
+from blake3 import blake3
 from langchain.schema import Document
 
+from app.core.config import settings
+
 logger = structlog.get_logger()
 
+# Punctuation deletion table and whitespace collapser for normalize_text
+_PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+_WS_RE = re.compile(r'\s+')
+_ws_sub = _WS_RE.sub
+_sha256 = hashlib.sha256
+
+# Bookkeeping fields that differ between upserts of the same chunk; left out of
+# the dedup hash so identical content and metadata always hash the same
+_VOLATILE_METADATA_KEYS = frozenset({'created_at', 'content_hash', 'embedding'})
+
+# Batches at least this large are hashed on a shared thread pool; the BLAKE3
+# and SHA256 implementations release the GIL while digesting their input
+_PARALLEL_HASH_THRESHOLD = 1000
+_HASH_THREADS = os.cpu_count() or 4
+_hash_executor: Optional[ThreadPoolExecutor] = None
+
+# Very large batches are split across processes instead: text normalization
+# holds the GIL, so threads stop scaling well before IPC costs matter
+_PROCESS_HASH_THRESHOLD = 20000
+_HASH_PROCESSES = os.cpu_count() or 4
+_hash_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    """Get the shared content-hashing thread pool, creating it on first use"""
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(
+            max_workers=_HASH_THREADS,
+            thread_name_prefix="content-hash"
+        )
+    return _hash_executor
+
+# SQLite caps bound parameters per statement (999 on older builds)
+_SQLITE_MAX_PARAMS = 900
+
+class SharedDedupIndex:
+    """Content digest -> document ID map in a SQLite file shared by every worker
+    
+    Drop-in for the in-process dict (get/pop/in/len/clear/item assignment), so
+    multi-worker deployments make consistent dedup decisions from one copy.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup ("
+            "hash BLOB PRIMARY KEY, "
+            "doc_id TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    def get(self, content_hash: bytes, default: Optional[str] = None) -> Optional[str]:
+        """Document ID tracked for a digest"""
+        return self.get_many([content_hash]).get(content_hash, default)
+    
+    def get_many(self, content_hashes: List[bytes]) -> Dict[bytes, str]:
+        """Document IDs for every tracked digest among content_hashes"""
+        found: Dict[bytes, str] = {}
+        unique = list(dict.fromkeys(content_hashes))
+        
+        with self._lock:
+            for i in range(0, len(unique), _SQLITE_MAX_PARAMS):
+                chunk = unique[i:i + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._conn.execute(
+                    f"SELECT hash, doc_id FROM dedup WHERE hash IN ({placeholders})", chunk
+                ).fetchall())
+        
+        return found
+    
+    def __contains__(self, content_hash: bytes) -> bool:
+        return self.get(content_hash) is not None
+    
+    def __setitem__(self, content_hash: bytes, doc_id: str):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dedup (hash, doc_id) VALUES (?, ?)", (content_hash, doc_id)
+                )
+    
+    def pop(self, content_hash: bytes, default: Optional[str] = None) -> Optional[str]:
+        """Stop tracking a digest, returning its document ID"""
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT doc_id FROM dedup WHERE hash = ?", (content_hash,)
+                ).fetchone()
+                if row:
+                    self._conn.execute("DELETE FROM dedup WHERE hash = ?", (content_hash,))
+        return row[0] if row else default
+    
+    def delete_many(self, content_hashes: List[bytes]) -> int:
+        """Stop tracking several digests in one transaction; returns how many were tracked"""
+        unique = list(dict.fromkeys(content_hashes))
+        removed = 0
+        with self._lock:
+            with self._conn:
+                for i in range(0, len(unique), _SQLITE_MAX_PARAMS):
+                    chunk = unique[i:i + _SQLITE_MAX_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    removed += self._conn.execute(
+                        f"DELETE FROM dedup WHERE hash IN ({placeholders})", chunk
+                    ).rowcount
+        return removed
+    
+    def update(self, items: List[Tuple[bytes, str]]):
+        """Track several digest -> document ID pairs in one transaction"""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO dedup (hash, doc_id) VALUES (?, ?)", items
+                )
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dedup").fetchone()[0]
+    
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM dedup")
+
+def _get_hash_process_pool() -> ProcessPoolExecutor:
+    """Get the shared content-hashing process pool, creating it on first use"""
+    global _hash_process_pool
+    if _hash_process_pool is None:
+        _hash_process_pool = ProcessPoolExecutor(max_workers=_HASH_PROCESSES)
+    return _hash_process_pool
+
+def _normalize_text(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return _ws_sub(' ', text.lower().translate(_PUNCT_TABLE)).strip()
+
+def _digest(algorithm: str, content: str, metadata_bytes: bytes) -> bytes:
+    """Raw digest of normalized content and serialized metadata"""
+    # Feed the hasher incrementally rather than building one concatenated string
+    hasher = _sha256() if algorithm == 'sha256' else blake3()
+    hasher.update(_normalize_text(content).encode('utf-8'))
+    hasher.update(b'|||')
+    hasher.update(metadata_bytes)
+    return hasher.digest()
+
+def _serialize_metadata(metadata: Any) -> bytes:
+    """Canonical metadata bytes: flat dict form, volatile fields dropped, sorted keys
+    
+    Upsert-time records (to_dict-able dataclasses) and stored Document metadata
+    must serialize identically, or re-upserting the same chunk never dedups.
+    """
+    if not isinstance(metadata, dict):
+        metadata = metadata.to_dict() if hasattr(metadata, 'to_dict') else dataclasses.asdict(metadata)
+    if not _VOLATILE_METADATA_KEYS.isdisjoint(metadata):
+        metadata = {key: value for key, value in metadata.items() if key not in _VOLATILE_METADATA_KEYS}
+    return orjson.dumps(metadata, default=str, option=orjson.OPT_SORT_KEYS)
+
+def _serialize_all(metadatas: List[Any]) -> List[bytes]:
+    """Canonical bytes for every metadata record, in input order"""
+    return [_serialize_metadata(metadata) for metadata in metadatas]
+
+def _hash_slice(algorithm: str, contents: List[str], metadata_bytes: List[bytes]) -> List[bytes]:
+    """Process-pool worker: hash one slice of a large batch"""
+    return [_digest(algorithm, content, meta) for content, meta in zip(contents, metadata_bytes)]
+
 class DeduplicationService:
     def __init__(self):
-        self.processed_hashes: Set[str] = set()
-        self.hash_to_doc_id: Dict[str, str] = {}
+        # Single map of raw content digest -> document ID; membership doubles as the seen-set.
+        # With dedup_index_path set, it lives in SQLite so every worker shares it
+        index_path = getattr(settings, 'dedup_index_path', '')
+        self.hash_to_doc_id = SharedDedupIndex(index_path) if index_path else {}
+        self.hash_algorithm = getattr(settings, 'content_hash_algorithm', 'blake3')
     
     def normalize_text(self, text: str) -> str:
         """Normalize text for consistent hashing"""
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        
-        # Convert to lowercase
-        text = text.lower()
+        return _normalize_text(text)
+    
+    def compute_content_hash(self, document: Document) -> bytes:
+        """Compute BLAKE3 (or SHA256, if configured) hash of normalized document content"""
+        return self.compute_hash(document.page_content, document.metadata)
+    
+    def compute_hash(self, content: str, metadata: Any) -> bytes:
+        """Compute the raw content digest from text and metadata (a dict or dataclass), without a Document"""
+        # Include metadata in hash for uniqueness
+        return _digest(self.hash_algorithm, content, _serialize_metadata(metadata))
+    
+    def compute_content_hashes(self, documents: List[Document]) -> List[bytes]:
+        """Compute content hashes for a batch of documents, in input order"""
+        return self.compute_hashes(
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents]
+        )
+    
+    def compute_hashes(self, contents: List[str], metadatas: List[Any]) -> List[bytes]:
+        """Compute content hashes for parallel lists of texts and metadata, in input order"""
+        if len(contents) < _PARALLEL_HASH_THRESHOLD:
+            return self._hash_many(contents, metadatas)
         
-        # Remove common punctuation that might vary
-        import re
-        text = re.sub(r'[^\w\s]', '', text)
+        if len(contents) < _PROCESS_HASH_THRESHOLD:
+            return list(_get_hash_executor().map(self.compute_hash, contents, metadatas))
         
-        return text.strip()
+        # Metadata is serialized here (orjson is fast C code) so workers only
+        # receive plain strings and bytes, one contiguous slice per process
+        metadata_bytes = _serialize_all(metadatas)
+        step = -(-len(contents) // _HASH_PROCESSES)
+        slices = _get_hash_process_pool().map(
+            _hash_slice,
+            [self.hash_algorithm] * _HASH_PROCESSES,
+            [contents[i:i + step] for i in range(0, len(contents), step)],
+            [metadata_bytes[i:i + step] for i in range(0, len(contents), step)]
+        )
+        return [digest for part in slices for digest in part]
     
-    def compute_content_hash(self, document: Document) -> str:
-        """Compute SHA256 hash of normalized document content"""
-        normalized_text = self.normalize_text(document.page_content)
+    async def compute_hashes_async(self, contents: List[str], metadatas: List[Any]) -> List[bytes]:
+        """compute_hashes without blocking the event loop
         
-        # Include metadata in hash for uniqueness
-        metadata_str = str(sorted(document.metadata.items()))
+        Uses the same size thresholds on the whole batch; parallel batches are
+        split into one contiguous slice per worker and the slices gathered.
+        """
+        if len(contents) < _PARALLEL_HASH_THRESHOLD:
+            return self.compute_hashes(contents, metadatas)
         
-        content = f"{normalized_text}|||{metadata_str}"
-        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+        loop = asyncio.get_running_loop()
+        if len(contents) < _PROCESS_HASH_THRESHOLD:
+            executor, workers = _get_hash_executor(), _HASH_THREADS
+            hash_slice = self._hash_many
+        else:
+            metadatas = await loop.run_in_executor(_get_hash_executor(), _serialize_all, metadatas)
+            executor, workers = _get_hash_process_pool(), _HASH_PROCESSES
+            hash_slice = partial(_hash_slice, self.hash_algorithm)
+        
+        step = -(-len(contents) // workers)
+        slices = await asyncio.gather(*[
+            loop.run_in_executor(executor, hash_slice, contents[i:i + step], metadatas[i:i + step])
+            for i in range(0, len(contents), step)
+        ])
+        return [digest for part in slices for digest in part]
+    
+    def _hash_many(self, contents: List[str], metadatas: List[Any]) -> List[bytes]:
+        """Hash parallel lists of texts and metadata in the calling thread"""
+        compute = self.compute_hash
+        return [compute(content, metadata) for content, metadata in zip(contents, metadatas)]
     
     def is_duplicate(self, document: Document) -> Tuple[bool, Optional[str]]:
         """Check if document is a duplicate"""
         content_hash = self.compute_content_hash(document)
         
-        if content_hash in self.processed_hashes:
-            existing_doc_id = self.hash_to_doc_id.get(content_hash)
+        existing_doc_id = self.hash_to_doc_id.get(content_hash)
+        if existing_doc_id is not None:
             return True, existing_doc_id
         
         return False, None
     
+    def is_duplicate_batch(self, documents: List[Document]) -> List[Tuple[bool, Optional[str]]]:
+        """Check a batch of documents for duplicates, results aligned to input"""
+        return [
+            (existing_doc_id is not None, existing_doc_id)
+            for existing_doc_id in self.find_existing(self.compute_content_hashes(documents))
+        ]
+    
+    def find_existing(self, content_hashes: List[bytes]) -> List[Optional[str]]:
+        """Look up already-tracked document IDs for precomputed hashes (None if new)"""
+        if isinstance(self.hash_to_doc_id, SharedDedupIndex):
+            lookup = self.hash_to_doc_id.get_many(content_hashes).get
+        else:
+            lookup = self.hash_to_doc_id.get
+        return [lookup(content_hash) for content_hash in content_hashes]
+    
     def add_document(self, document: Document, doc_id: str) -> bool:
         """Add document to deduplication tracking"""
         content_hash = self.compute_content_hash(document)
         
-        if content_hash in self.processed_hashes:
+        if content_hash in self.hash_to_doc_id:
             return False  # Duplicate
         
-        self.processed_hashes.add(content_hash)
         self.hash_to_doc_id[content_hash] = doc_id
         return True
     
@@ -60,42 +307,71 @@ class DeduplicationService:
         """Remove document from deduplication tracking"""
         content_hash = self.compute_content_hash(document)
         
-        if content_hash in self.processed_hashes:
-            self.processed_hashes.remove(content_hash)
-            if content_hash in self.hash_to_doc_id:
-                del self.hash_to_doc_id[content_hash]
-            return True
+        return self.hash_to_doc_id.pop(content_hash, None) is not None
+    
+    def remove_documents(self, documents: List[Document]) -> int:
+        """Remove a batch of documents from deduplication tracking"""
+        return self.remove_hashes(self.compute_content_hashes(documents))
+    
+    def remove_hashes(self, content_hashes: List[bytes]) -> int:
+        """Stop tracking already-computed content hashes; returns how many were tracked"""
+        if isinstance(self.hash_to_doc_id, SharedDedupIndex):
+            return self.hash_to_doc_id.delete_many(content_hashes)
         
-        return False
+        pop = self.hash_to_doc_id.pop
+        return sum(pop(content_hash, None) is not None for content_hash in content_hashes)
     
-    def deduplicate_documents(self, documents: List[Document]) -> Tuple[List[Document], List[Document]]:
-        """Separate unique and duplicate documents"""
-        unique_docs = []
+    def register_hash(self, content_hash: bytes, doc_id: str):
+        """Add an already-computed content hash to deduplication tracking"""
+        self.hash_to_doc_id[content_hash] = doc_id
+    
+    def register_hashes(self, items: List[Tuple[bytes, str]]):
+        """Add several already-computed (content hash, document ID) pairs at once"""
+        self.hash_to_doc_id.update(items)
+    
+    def partition_documents(self, documents: List[Document],
+                            content_hashes: Optional[List[bytes]] = None) -> Tuple[List[Tuple[int, Document, bytes]], List[Document]]:
+        """Split documents into (index, document, content_hash) uniques and duplicates.
+        
+        Each document is hashed at most once (not at all when content_hashes are
+        passed in); duplicates within the batch are caught too. Uniques are not
+        tracked until their hashes are passed to register_hash.
+        """
+        uniques = []
         duplicate_docs = []
+        seen_in_batch = set()
         
-        for doc in documents:
-            is_dup, existing_id = self.is_duplicate(doc)
-            
-            if is_dup:
+        if content_hashes is None:
+            content_hashes = self.compute_content_hashes(documents)
+        
+        existing_ids = self.find_existing(content_hashes)
+        
+        for i, (doc, content_hash, existing_id) in enumerate(zip(documents, content_hashes, existing_ids)):
+            if existing_id is not None or content_hash in seen_in_batch:
                 duplicate_docs.append(doc)
                 logger.debug(f"Found duplicate document, existing ID: {existing_id}")
             else:
-                unique_docs.append(doc)
+                seen_in_batch.add(content_hash)
+                uniques.append((i, doc, content_hash))
         
-        logger.info(f"Deduplication: {len(unique_docs)} unique, {len(duplicate_docs)} duplicates")
-        return unique_docs, duplicate_docs
+        logger.info(f"Deduplication: {len(uniques)} unique, {len(duplicate_docs)} duplicates")
+        return uniques, duplicate_docs
+    
+    def deduplicate_documents(self, documents: List[Document]) -> Tuple[List[Document], List[Document]]:
+        """Separate unique and duplicate documents"""
+        uniques, duplicate_docs = self.partition_documents(documents)
+        return [doc for _, doc, _ in uniques], duplicate_docs
     
     def get_duplicate_stats(self) -> Dict[str, Any]:
         """Get deduplication statistics"""
         return {
-            "total_processed": len(self.processed_hashes),
-            "unique_documents": len(self.processed_hashes),
+            "total_processed": len(self.hash_to_doc_id),
+            "unique_documents": len(self.hash_to_doc_id),
             "duplicate_rate": 0.0  # Would need to track total processed vs unique
         }
     
     def clear_tracking(self):
         """Clear all deduplication tracking"""
-        self.processed_hashes.clear()
         self.hash_to_doc_id.clear()
         logger.info("Deduplication tracking cleared")
 
@@ -105,8 +381,9 @@ class UpsertService:
         self.dedup_service = deduplication_service
     
     async def upsert_documents(self, collection_name: str, documents: List[Document], 
-                              embeddings: List[List[float]]) -> Dict[str, Any]:
-        """Upsert documents with deduplication"""
+                              embeddings: List[List[float]],
+                              content_hashes: Optional[List[bytes]] = None) -> Dict[str, Any]:
+        """Upsert documents with deduplication (content_hashes: precomputed, aligned to documents)"""
         results = {
             "total_documents": len(documents),
             "unique_documents": 0,
@@ -116,31 +393,31 @@ class UpsertService:
         }
         
         try:
-            # Deduplicate documents
-            unique_docs, duplicate_docs = self.dedup_service.deduplicate_documents(documents)
-            results["unique_documents"] = len(unique_docs)
+            # Deduplicate documents (hashes each document at most once)
+            uniques, duplicate_docs = self.dedup_service.partition_documents(documents, content_hashes)
+            results["unique_documents"] = len(uniques)
             results["duplicate_documents"] = len(duplicate_docs)
             
-            if not unique_docs:
+            if not uniques:
                 logger.info("No unique documents to upsert")
                 return results
             
             # Prepare unique documents for upsert
+            unique_docs = []
             unique_embeddings = []
-            doc_ids = []
+            tracked = []
             
-            for i, doc in enumerate(unique_docs):
+            for i, (original_index, doc, content_hash) in enumerate(uniques):
                 # Generate document ID
                 doc_id = f"{doc.metadata.get('source', 'unknown')}_{doc.metadata.get('chunk_index', i)}"
-                doc_ids.append(doc_id)
+                tracked.append((content_hash, doc_id))
                 
-                # Add to deduplication tracking
-                self.dedup_service.add_document(doc, doc_id)
-                
-                # Find corresponding embedding
-                original_index = documents.index(doc)
+                unique_docs.append(doc)
                 unique_embeddings.append(embeddings[original_index])
             
+            # Add to deduplication tracking in one batch
+            self.dedup_service.register_hashes(tracked)
+            
             # Upsert to vector store
             success = await self.vector_store.add_documents(
                 collection_name, unique_docs, unique_embeddings
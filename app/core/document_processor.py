@@ -1,33 +1,141 @@
+import io
 import os
+import sys
 import asyncio
+import contextlib
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import aiofiles
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable, Awaitable, Union
 from pathlib import Path
 import PyPDF2
 import fitz  # PyMuPDF
 import tiktoken
-from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownTextSplitter
 from langchain.schema import Document
+from semantic_text_splitter import MarkdownSplitter
 import structlog
 
+from app.core.config import settings
+
 logger = structlog.get_logger()
 
+_TOKENIZER_THREADS = max(1, (os.cpu_count() or 2) // 2)
+_MD_SUFFIXES = frozenset({sys.intern('.md'), sys.intern('.markdown')})
+# First bytes of tokens that begin a new word, where token windows may be cut
+_WHITESPACE_BYTES = frozenset(b" \t\n\r\f\v")
+
+# Text files below this size are read in one blocking call on a worker thread
+_SMALL_FILE_MAX_BYTES = 1 << 20
+
+# PDFs are split into at most this many page ranges, each extracted in its own
+# worker process; PyMuPDF text extraction is CPU-bound and holds the GIL
+_PDF_WORKERS = min(os.cpu_count() or 1, 4)
+_MIN_PAGES_PER_WORKER = 8
+# PDFs up to this size are read into memory once and parsed from the buffer
+_PDF_IN_MEMORY_MAX_BYTES = 32 * 1024 * 1024
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+# Whole files (extract + chunk) are processed on a separate pool in _process_batch
+_file_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Get the shared PDF extraction process pool, creating it on first use"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(max_workers=_PDF_WORKERS)
+    return _pdf_executor
+
+def _get_file_executor() -> ProcessPoolExecutor:
+    """Get the shared file processing process pool, creating it on first use"""
+    global _file_executor
+    if _file_executor is None:
+        _file_executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _file_executor
+
+def _open_pdf(source: Union[str, bytes]) -> fitz.Document:
+    """Open a PDF from a path or from its raw bytes"""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def _extract_pages(source: Union[str, bytes], start: int, end: int) -> str:
+    """Extract text from pages [start, end) of a PDF (runs in a worker process)"""
+    with _open_pdf(source) as doc:
+        # Plain text in content-stream order; chunking does not need layout sorting
+        return "".join([doc[i].get_text("text", sort=False) for i in range(start, end)])
+
+def _pdf_source(file_path: Path, file_size: int) -> Union[str, bytes]:
+    """Bytes to reuse for PyMuPDF and the PyPDF2 fallback; very large PDFs stay a path"""
+    return file_path.read_bytes() if file_size <= _PDF_IN_MEMORY_MAX_BYTES else str(file_path)
+
+def _pdf_page_ranges(source: Union[str, bytes], max_shards: int) -> List[Tuple[int, int]]:
+    """Split a PDF's pages into at most max_shards roughly equal [start, end) ranges"""
+    with _open_pdf(source) as doc:
+        page_count = doc.page_count
+    if page_count == 0:
+        return []
+    shards = max(1, min(max_shards, page_count // _MIN_PAGES_PER_WORKER))
+    step = -(-page_count // shards)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+def _extract_pdf_fallback(source: Union[str, bytes]) -> str:
+    """Extract PDF text with PyPDF2 (slower, but tolerant of some files PyMuPDF rejects)"""
+    reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    return "".join([page.extract_text() or "" for page in reader.pages])
+
+def _read_text_file(file_path: Path) -> str:
+    """Read a UTF-8 text file in one call"""
+    return file_path.read_text(encoding='utf-8')
+
+@lru_cache(maxsize=8)
+def _get_encoding(name: str) -> tiktoken.Encoding:
+    """Shared tiktoken encoding (the BPE ranks are loaded once per process)"""
+    return tiktoken.get_encoding(name)
+
+@lru_cache(maxsize=32)
+def _get_markdown_splitter(chunk_size: int, chunk_overlap: int) -> MarkdownSplitter:
+    """Shared markdown splitter per size/overlap (splitters hold no per-call state)"""
+    return MarkdownSplitter(chunk_size, overlap=chunk_overlap)
+
+def _process_single_file_sync(file_path: str, chunk_size: int, chunk_overlap: int,
+                              chunk_size_tokens: int, chunk_overlap_tokens: int) -> List[Document]:
+    """Extract and chunk one file synchronously (runs in a worker process)"""
+    processor = _get_worker_processor(chunk_size, chunk_overlap, chunk_size_tokens, chunk_overlap_tokens)
+    return processor.process_single_file_sync(file_path)
+
+@lru_cache(maxsize=8)
+def _get_worker_processor(chunk_size: int, chunk_overlap: int,
+                          chunk_size_tokens: int, chunk_overlap_tokens: int) -> "DocumentProcessor":
+    """Per-process DocumentProcessor, built once per chunking configuration"""
+    return DocumentProcessor(chunk_size, chunk_overlap, chunk_size_tokens, chunk_overlap_tokens)
+
 class DocumentProcessor:
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 chunk_size_tokens: Optional[int] = None, chunk_overlap_tokens: Optional[int] = None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        self.markdown_splitter = MarkdownTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
+        self.chunk_size_tokens = chunk_size_tokens or settings.chunk_size_tokens
+        self.chunk_overlap_tokens = (
+            settings.chunk_overlap_tokens if chunk_overlap_tokens is None else chunk_overlap_tokens
         )
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        if self.chunk_overlap_tokens >= self.chunk_size_tokens:
+            raise ValueError("chunk_overlap_tokens must be smaller than chunk_size_tokens")
+        
+        # Markdown is split on its structure (Rust splitter, sized in characters);
+        # everything else is cut into token windows in _split_tokens
+        self.markdown_splitter = _get_markdown_splitter(chunk_size, chunk_overlap)
+        self.encoding = _get_encoding("cl100k_base")
+        
+        # Text extractor per (lowercased) file suffix
+        self._extractors = {
+            '.pdf': self._extract_pdf_text,
+            '.md': self._extract_markdown_text,
+            '.markdown': self._extract_markdown_text,
+            '.txt': self._extract_text_file,
+            '.text': self._extract_text_file
+        }
     
     async def process_files(self, file_paths: List[str], batch_size: int = 100) -> List[Document]:
         """Process multiple files asynchronously in batches"""
@@ -42,8 +150,17 @@ class DocumentProcessor:
         return all_documents
     
     async def _process_batch(self, file_paths: List[str]) -> List[Document]:
-        """Process a batch of files concurrently"""
-        tasks = [self.process_single_file(path) for path in file_paths]
+        """Process a batch of files in parallel across worker processes"""
+        # Extraction and chunking are CPU-bound, so spread whole files over cores
+        loop = asyncio.get_running_loop()
+        executor = _get_file_executor()
+        tasks = [
+            loop.run_in_executor(
+                executor, _process_single_file_sync, path, self.chunk_size, self.chunk_overlap,
+                self.chunk_size_tokens, self.chunk_overlap_tokens
+            )
+            for path in file_paths
+        ]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
         documents = []
@@ -55,34 +172,137 @@ class DocumentProcessor:
         
         return documents
     
+    async def process_and_embed(self, file_paths: List[str],
+                                embed_documents: Callable[[List[Document]], Awaitable[List[Document]]],
+                                embed_batch_size: int = 100,
+                                embed_concurrency: int = 4,
+                                parse_workers: int = 8) -> List[Document]:
+        """Parse, chunk and embed files as an overlapping three-stage pipeline
+        
+        Stages are connected by bounded queues, so embedding requests start as
+        soon as the first chunks exist instead of after the whole batch is parsed.
+        embed_documents (e.g. EmbeddingService.embed_documents_async) must set
+        metadata["embedding"] on the chunks it returns; up to embed_concurrency
+        batches are in flight at once.
+        """
+        parse_q: asyncio.Queue = asyncio.Queue(maxsize=2 * embed_batch_size)
+        chunk_q: asyncio.Queue = asyncio.Queue(maxsize=2 * embed_batch_size)
+        paths = iter(file_paths)
+        embedded: List[Document] = []
+        
+        async def parse_worker():
+            for path in paths:
+                try:
+                    loaded = await self._load_file(path)
+                except Exception as e:
+                    logger.error(f"Error processing {path}: {e}")
+                    continue
+                if loaded is not None:
+                    await parse_q.put(loaded)
+        
+        def close_on_failure(queue: asyncio.Queue):
+            # The consumer may be gone too, so never wait on a full queue here
+            with contextlib.suppress(asyncio.QueueFull):
+                queue.put_nowait(None)
+        
+        async def parse_stage():
+            try:
+                await asyncio.gather(*[parse_worker() for _ in range(max(1, min(parse_workers, len(file_paths))))])
+            except BaseException:
+                close_on_failure(parse_q)
+                raise
+            await parse_q.put(None)
+        
+        async def chunk_stage():
+            try:
+                while (item := await parse_q.get()) is not None:
+                    # Tokenizing is CPU-bound; keep it off the event loop so the parse
+                    # and embed stages keep making progress
+                    text, metadata = item
+                    documents = await asyncio.to_thread(self._split_text, text, metadata)
+                    logger.info(f"Processed {metadata['source']}: {len(documents)} chunks")
+                    if documents:
+                        await chunk_q.put(documents)
+            except BaseException:
+                close_on_failure(chunk_q)
+                raise
+            await chunk_q.put(None)
+        
+        async def embed_stage():
+            pending: List[Document] = []
+            in_flight = asyncio.Semaphore(max(1, embed_concurrency))
+            batches: List[asyncio.Task] = []
+            
+            async def embed(batch: List[Document]) -> List[Document]:
+                try:
+                    return await embed_documents(batch)
+                finally:
+                    in_flight.release()
+            
+            async def flush(batch: List[Document]):
+                # Waiting for a free slot here keeps back-pressure on the queues
+                await in_flight.acquire()
+                for task in batches:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        # Fail fast instead of embedding the rest of the input
+                        in_flight.release()
+                        raise task.exception()
+                batches.append(asyncio.create_task(embed(batch)))
+            
+            try:
+                while (documents := await chunk_q.get()) is not None:
+                    pending.extend(documents)
+                    while len(pending) >= embed_batch_size:
+                        batch, pending = pending[:embed_batch_size], pending[embed_batch_size:]
+                        await flush(batch)
+                if pending:
+                    await flush(pending)
+                for documents in await asyncio.gather(*batches):
+                    embedded.extend(documents)
+            except BaseException:
+                for task in batches:
+                    task.cancel()
+                await asyncio.gather(*batches, return_exceptions=True)
+                raise
+        
+        stages = [asyncio.create_task(stage()) for stage in (parse_stage, chunk_stage, embed_stage)]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            # A failed stage would leave its neighbours blocked on a full or empty queue
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+        
+        return embedded
+    
     async def process_single_file(self, file_path: str) -> List[Document]:
         """Process a single file and return list of documents"""
         try:
-            file_path = Path(file_path)
-            if not file_path.exists():
-                raise FileNotFoundError(f"File not found: {file_path}")
+            loaded = await self._load_file(file_path)
+            if loaded is None:
+                return []
             
-            # Check file size
-            file_size_mb = file_path.stat().st_size / (1024 * 1024)
-            if file_size_mb > 100:  # 100MB limit
-                raise ValueError(f"File too large: {file_size_mb:.2f}MB")
+            # Split text into chunks
+            text, metadata = loaded
+            documents = await asyncio.to_thread(self._split_text, text, metadata)
             
-            # Extract text based on file type
-            text = await self._extract_text(file_path)
-            if not text.strip():
-                logger.warning(f"No text extracted from {file_path}")
-                return []
+            logger.info(f"Processed {file_path}: {len(documents)} chunks")
+            return documents
             
-            # Create metadata
-            metadata = {
-                "source": str(file_path),
-                "file_name": file_path.name,
-                "file_type": file_path.suffix.lower(),
-                "file_size_mb": round(file_size_mb, 2),
-                "text_length": len(text)
-            }
+        except Exception as e:
+            logger.error(f"Error processing {file_path}: {e}")
+            return []
+    
+    def process_single_file_sync(self, file_path: str) -> List[Document]:
+        """Process a single file without an event loop (for worker processes)"""
+        try:
+            loaded = self._load_file_sync(file_path)
+            if loaded is None:
+                return []
             
-            # Split text into chunks
+            text, metadata = loaded
             documents = self._split_text(text, metadata)
             
             logger.info(f"Processed {file_path}: {len(documents)} chunks")
@@ -92,69 +312,233 @@ class DocumentProcessor:
             logger.error(f"Error processing {file_path}: {e}")
             return []
     
-    async def _extract_text(self, file_path: Path) -> str:
+    async def _load_file(self, file_path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Validate a file and extract its text and base metadata (None if it has no text)"""
+        path, suffix, file_size = self._check_file(file_path)
+        
+        # Extract text based on file type
+        text = await self._extract_text(path, suffix, file_size)
+        return self._with_metadata(path, suffix, file_size, text)
+    
+    def _load_file_sync(self, file_path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Blocking counterpart of _load_file"""
+        path, suffix, file_size = self._check_file(file_path)
+        text = self._extract_text_sync(path, suffix, file_size)
+        return self._with_metadata(path, suffix, file_size, text)
+    
+    def _with_metadata(self, file_path: Path, suffix: str, file_size: int,
+                       text: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Pair extracted text with its base metadata (None if it has no text)"""
+        if not text.strip():
+            logger.warning(f"No text extracted from {file_path}")
+            return None
+        return text, self._base_metadata(file_path, suffix, file_size, text)
+    
+    def _check_file(self, file_path: str) -> Tuple[Path, str, int]:
+        """Validate that a file exists and is within the size limit"""
+        file_path = Path(file_path)
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        # Check file size
+        file_size = file_path.stat().st_size
+        file_size_mb = file_size / (1024 * 1024)
+        if file_size_mb > 100:  # 100MB limit
+            raise ValueError(f"File too large: {file_size_mb:.2f}MB")
+        
+        return file_path, file_path.suffix.lower(), file_size
+    
+    def _base_metadata(self, file_path: Path, suffix: str, file_size: int, text: str) -> Dict[str, Any]:
+        """Metadata shared by every chunk of a file"""
+        return {
+            "source": str(file_path),
+            "file_name": file_path.name,
+            "file_type": suffix,
+            "file_size_mb": round(file_size / (1024 * 1024), 2),
+            "text_length": len(text)
+        }
+    
+    def _extract_text_sync(self, file_path: Path, suffix: str, file_size: int) -> str:
+        """Extract text in the calling process, without the async extractors' pools"""
+        if suffix not in self._extractors:
+            raise ValueError(f"Unsupported file type: {suffix}")
+        
+        if suffix != '.pdf':
+            return _read_text_file(file_path)
+        
+        source = _pdf_source(file_path, file_size)
+        try:
+            # Worker processes already spread whole files over the cores, so the
+            # page ranges are extracted in-process
+            return "".join([_extract_pages(source, start, end) for start, end in _pdf_page_ranges(source, 1)])
+        except Exception as e:
+            logger.warning(f"PyMuPDF failed for {file_path}, trying PyPDF2: {e}")
+            return _extract_pdf_fallback(source)
+    
+    async def _extract_text(self, file_path: Path, suffix: str, file_size: int) -> str:
         """Extract text from various file formats"""
-        suffix = file_path.suffix.lower()
-        
-        if suffix == '.pdf':
-            return await self._extract_pdf_text(file_path)
-        elif suffix in ['.md', '.markdown']:
-            return await self._extract_markdown_text(file_path)
-        elif suffix in ['.txt', '.text']:
-            return await self._extract_text_file(file_path)
-        else:
+        extractor = self._extractors.get(suffix)
+        if extractor is None:
             raise ValueError(f"Unsupported file type: {suffix}")
+        return await extractor(file_path, file_size)
     
-    async def _extract_pdf_text(self, file_path: Path) -> str:
+    async def _extract_pdf_text(self, file_path: Path, file_size: int) -> str:
         """Extract text from PDF using PyMuPDF for better performance"""
+        # Read the file once and reuse the bytes for PyMuPDF and the PyPDF2
+        # fallback; very large PDFs are opened by path to avoid holding a copy
+        source: Union[str, bytes] = str(file_path)
+        if file_size <= _PDF_IN_MEMORY_MAX_BYTES:
+            async with aiofiles.open(file_path, 'rb') as file:
+                source = await file.read()
+        
         try:
-            doc = fitz.open(str(file_path))
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
+            # Opening the PDF parses its xref table; keep that off the event loop
+            ranges = await asyncio.to_thread(_pdf_page_ranges, source, _PDF_WORKERS)
+            
+            # A single range ships the buffer to its worker; multiple shards reopen
+            # by path rather than pickling the whole buffer once per worker
+            shard_source = source if len(ranges) == 1 else str(file_path)
+            
+            loop = asyncio.get_running_loop()
+            executor = _get_pdf_executor()
+            parts = await asyncio.gather(*[
+                loop.run_in_executor(executor, _extract_pages, shard_source, start, end)
+                for start, end in ranges
+            ])
+            return "".join(parts)
         except Exception as e:
             logger.warning(f"PyMuPDF failed for {file_path}, trying PyPDF2: {e}")
-            # Fallback to PyPDF2
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-            return text
-    
-    async def _extract_markdown_text(self, file_path: Path) -> str:
+            return await asyncio.to_thread(_extract_pdf_fallback, source)
+    
+    async def _extract_markdown_text(self, file_path: Path, file_size: int) -> str:
         """Extract text from markdown file"""
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as file:
-            return await file.read()
+        return await self._read_text(file_path, file_size)
     
-    async def _extract_text_file(self, file_path: Path) -> str:
+    async def _extract_text_file(self, file_path: Path, file_size: int) -> str:
         """Extract text from plain text file"""
+        return await self._read_text(file_path, file_size)
+    
+    async def _read_text(self, file_path: Path, file_size: int) -> str:
+        """Read a UTF-8 text file"""
+        # Small files: one read_text call in the thread pool beats aiofiles'
+        # per-operation round trips through the executor
+        if file_size < _SMALL_FILE_MAX_BYTES:
+            return await asyncio.to_thread(_read_text_file, file_path)
+        
         async with aiofiles.open(file_path, 'r', encoding='utf-8') as file:
             return await file.read()
     
     def _split_text(self, text: str, metadata: Dict[str, Any]) -> List[Document]:
         """Split text into chunks using appropriate splitter"""
         # Use markdown splitter for markdown files
-        if metadata.get("file_type") in ['.md', '.markdown']:
-            chunks = self.markdown_splitter.split_text(text)
+        if metadata.get("file_type") in _MD_SUFFIXES:
+            chunks = self.markdown_splitter.chunks(text)
+            
+            # Count tokens for all chunks in one call; tiktoken runs the BPE on
+            # native threads without holding the GIL
+            token_counts = [
+                len(ids) for ids in self.encoding.encode_ordinary_batch(chunks, num_threads=_TOKENIZER_THREADS)
+            ]
         else:
-            chunks = self.text_splitter.split_text(text)
+            chunks, token_counts = self._split_tokens(text)
+        
+        # Drop whitespace-only chunks (common on badly extracted PDFs); they would
+        # still cost an embedding request slot
+        if any(not chunk or chunk.isspace() for chunk in chunks):
+            kept = [(chunk, count) for chunk, count in zip(chunks, token_counts) if chunk and not chunk.isspace()]
+            chunks = [chunk for chunk, _ in kept]
+            token_counts = [count for _, count in kept]
         
         # Create Document objects with metadata
-        documents = []
-        for i, chunk in enumerate(chunks):
+        documents = [None] * len(chunks)
+        for i, (chunk, token_count) in enumerate(zip(chunks, token_counts)):
             doc_metadata = metadata.copy()
             doc_metadata.update({
                 "chunk_index": i,
                 "chunk_size": len(chunk),
-                "token_count": len(self.encoding.encode(chunk))
+                "token_count": token_count
             })
             
-            documents.append(Document(
+            documents[i] = Document(
                 page_content=chunk,
                 metadata=doc_metadata
-            ))
+            )
         
         return documents
+    
+    def _split_tokens(self, text: str) -> Tuple[List[str], List[int]]:
+        """Split text into overlapping windows of at most chunk_size_tokens tokens
+        
+        Window edges are snapped back to a token that starts with whitespace, so
+        words are not cut; a window with no such token in range is cut at the
+        nearest UTF-8 character boundary instead, so decoding never yields U+FFFD.
+        Only a single character that needs more than chunk_size_tokens tokens is
+        kept whole in a window longer than the budget.
+        """
+        ids = self.encoding.encode_ordinary(text)
+        total = len(ids)
+        size = self.chunk_size_tokens
+        overlap = self.chunk_overlap_tokens
+        
+        # Classify each token by its first byte: word boundary (whitespace) or
+        # continuation of a multibyte character (0b10xxxxxx)
+        first_bytes = [token[0] for token in self.encoding.decode_tokens_bytes(ids)]
+        word_starts = [0] + [i for i in range(1, total) if first_bytes[i] in _WHITESPACE_BYTES] + [total]
+        
+        def char_start(position: int, step: int) -> int:
+            """Nearest position from here (moving by step) not inside a multibyte character"""
+            while 0 < position < total and first_bytes[position] & 0xC0 == 0x80:
+                position += step
+            return position
+        
+        windows = []
+        start = 0
+        end = 0
+        while end < total:
+            # End on the latest word start that still moves past the previous window
+            limit = start + size
+            if limit >= total:
+                end = total
+            else:
+                floor = max(start, end)
+                bound = word_starts[bisect_right(word_starts, limit) - 1]
+                if bound > floor:
+                    end = bound
+                else:
+                    end = char_start(limit, -1)
+                    if end <= floor and start < floor:
+                        # No character ends between the previous window and the
+                        # budget: drop the overlap rather than run past the budget
+                        start = floor
+                        limit = min(start + size, total)
+                        end = char_start(limit, -1)
+                    if end <= floor:
+                        end = char_start(floor + 1, 1)
+            windows.append(ids[start:end])
+            
+            if end < total and overlap:
+                # Begin the next window about `overlap` tokens back, on a word start
+                # (preferring a shorter overlap), else on a character start
+                target = end - overlap
+                index = bisect_left(word_starts, target)
+                if word_starts[index] < end:
+                    start = word_starts[index]
+                elif word_starts[index - 1] > start:
+                    start = word_starts[index - 1]
+                else:
+                    start = min(char_start(max(target, start + 1), 1), end)
+            else:
+                start = end
+        
+        decoded = self.encoding.decode_batch(windows, num_threads=_TOKENIZER_THREADS)
+        chunks = [chunk.strip() for chunk in decoded]
+        
+        # Count what is actually stored: re-encode only the windows that lost
+        # edge whitespace to strip()
+        token_counts = [len(window) for window in windows]
+        stripped = [i for i, chunk in enumerate(chunks) if len(chunk) != len(decoded[i])]
+        if stripped:
+            recounted = self.encoding.encode_ordinary_batch([chunks[i] for i in stripped], num_threads=_TOKENIZER_THREADS)
+            for i, chunk_ids in zip(stripped, recounted):
+                token_counts[i] = len(chunk_ids)
+        return chunks, token_counts
@@ -0,0 +1,140 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import structlog
+from xxhash import xxh3_64_intdigest
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+# SQLite caps bound parameters per statement (999 on older builds)
+_SQLITE_MAX_PARAMS = 900
+
+class EmbeddingCache:
+    """Persistent on-disk cache of chunk embeddings keyed by (content hash, model)"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or settings.embedding_cache_path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "hash BLOB NOT NULL, "
+            "model TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "PRIMARY KEY (hash, model)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    def lookup(self, hashes: Sequence[bytes], model: str) -> Dict[bytes, List[float]]:
+        """Return cached vectors for the given hashes (misses are omitted)"""
+        found: Dict[bytes, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        
+        with self._lock:
+            for i in range(0, len(unique), _SQLITE_MAX_PARAMS):
+                chunk = unique[i:i + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    (model, *chunk)
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        
+        return found
+    
+    def write(self, content_hash: bytes, model: str, vector: List[float]):
+        """Store a single embedding"""
+        self.write_many([(content_hash, vector)], model)
+    
+    def write_many(self, items: Sequence[Tuple[bytes, List[float]]], model: str):
+        """Upsert several embeddings in one transaction"""
+        if not items:
+            return
+        
+        rows = [
+            (content_hash, model, np.asarray(vector, dtype=np.float32).tobytes())
+            for content_hash, vector in items
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, model, vector) VALUES (?, ?, ?)",
+                    rows
+                )
+    
+    def close(self):
+        """Close the underlying SQLite connection"""
+        with self._lock:
+            self._conn.close()
+
+# Popcount of every byte value, for Hamming distances between 64-bit fingerprints
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_WORD_RE = re.compile(r"\w+")
+
+def simhash64(text: str) -> int:
+    """64-bit SimHash of a text's lowercased word bigrams"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) > 1:
+        features = [f"{a} {b}" for a, b in zip(words, words[1:])]
+    else:
+        features = words or [text]
+    
+    hashes = np.fromiter((xxh3_64_intdigest(f) for f in features), dtype=np.uint64, count=len(features))
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, 64)
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(features)
+    return int(np.packbits(majority).view(np.uint64)[0])
+
+class NearDuplicateEmbeddingCache:
+    """In-memory SimHash index of recent embeddings for near-identical chunks
+    
+    Chunks that differ only by whitespace, punctuation or a word or two land
+    within a few bits of each other and reuse the stored vector instead of
+    being re-embedded. Entries are evicted oldest-first once full.
+    """
+    
+    def __init__(self, max_entries: int = None, max_distance: int = None):
+        self.max_entries = max_entries or settings.near_duplicate_cache_size
+        self.max_distance = settings.near_duplicate_max_distance if max_distance is None else max_distance
+        self._fingerprints = np.zeros(self.max_entries, dtype=np.uint64)
+        self._vectors: List[Optional[List[float]]] = [None] * self.max_entries
+        self._size = 0
+        self._next = 0
+    
+    def lookup(self, text: str) -> Optional[List[float]]:
+        """Return the vector of the closest stored chunk within max_distance bits"""
+        if not self._size:
+            return None
+        
+        fingerprint = np.uint64(simhash64(text))
+        xor = np.bitwise_xor(self._fingerprints[:self._size], fingerprint)
+        distances = _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        best = int(distances.argmin())
+        if distances[best] > self.max_distance:
+            return None
+        return self._vectors[best]
+    
+    def add(self, text: str, vector: List[float]):
+        """Index a freshly embedded chunk"""
+        self._fingerprints[self._next] = simhash64(text)
+        self._vectors[self._next] = vector
+        self._next = (self._next + 1) % self.max_entries
+        self._size = min(self._size + 1, self.max_entries)
+    
+    def clear(self):
+        """Drop all indexed chunks"""
+        self._vectors = [None] * self.max_entries
+        self._size = 0
+        self._next = 0
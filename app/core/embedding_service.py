@@ -1,16 +1,20 @@
 import asyncio
+from collections import OrderedDict
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from openai import AsyncOpenAI
 from sentence_transformers import SentenceTransformer
+import torch
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 import structlog
+from blake3 import blake3
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.core.config import settings
+from app.core.embedding_cache import EmbeddingCache, NearDuplicateEmbeddingCache
+from app.core.rate_limiting import TokenBucket
 
 logger = structlog.get_logger()
 
@@ -18,8 +22,19 @@ class EmbeddingService:
     def __init__(self):
         self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.embedding_model = settings.embedding_model
+        self._model_key_prefix = self.embedding_model.encode() + b"\0"
         self.batch_size = settings.embedding_batch_size
         self.dimension = settings.embedding_dimension
+        self.concurrency = settings.embedding_concurrency
+        self.token_limiter = TokenBucket(settings.openai_tpm) if settings.openai_tpm > 0 else None
+        self.embedding_cache = EmbeddingCache() if settings.enable_embedding_cache else None
+        self.near_duplicate_cache = NearDuplicateEmbeddingCache() if settings.enable_near_duplicate_cache else None
+        
+        # Bounded LRU of query embeddings, plus per-key locks so concurrent
+        # misses for the same query share a single provider call
+        self._query_cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._query_cache_cap = settings.query_embedding_cache_size
+        self._query_locks: Dict[bytes, asyncio.Lock] = {}
         
         # Initialize embedding model
         if self.embedding_model.startswith("text-embedding"):
@@ -29,33 +44,131 @@ class EmbeddingService:
                 chunk_size=self.batch_size
             )
         else:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=self.embedding_model,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
+            # Use SentenceTransformer directly so whole batches go through one
+            # encode call; on GPU run in FP16 to halve memory traffic
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.embeddings = SentenceTransformer(self.embedding_model, device=device)
+            if device == 'cuda':
+                self.embeddings.half()
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    async def embed_documents_batch(self, documents: List[Document]) -> List[List[float]]:
-        """Embed a batch of documents with retry logic"""
+    async def embed_documents_batch(self, documents: List[Document]) -> List[Optional[List[float]]]:
+        """Embed a batch of documents with retry logic, reusing cached embeddings
+        
+        Blank documents get None instead of a vector; callers must drop them.
+        """
         try:
             texts = [doc.page_content for doc in documents]
             
-            if self.embedding_model.startswith("text-embedding"):
-                embeddings = await self._embed_with_openai(texts)
-            else:
-                embeddings = await self._embed_with_sentence_transformers(texts)
+            # Embed each distinct text once (boilerplate headers/footers repeat a
+            # lot) and fan the vectors back out to the duplicates
+            positions: Dict[str, int] = {}
+            unique_texts: List[str] = []
+            index_map = []
+            for text in texts:
+                if not text or text.isspace():
+                    # Blank chunks have nothing to embed (and a zero vector would be
+                    # stored as a real, unmatchable point)
+                    index_map.append(-1)
+                    continue
+                position = positions.get(text)
+                if position is None:
+                    position = positions[text] = len(unique_texts)
+                    unique_texts.append(text)
+                index_map.append(position)
             
-            logger.info(f"Successfully embedded {len(documents)} documents")
+            unique_embeddings, cache_hits = await self._embed_with_cache(unique_texts) if unique_texts else ([], 0)
+            
+            embeddings = [unique_embeddings[i] if i >= 0 else None for i in index_map]
+            
+            logger.info(
+                f"Successfully embedded {len(documents)} documents "
+                f"({len(unique_texts)} unique, {cache_hits} from cache)"
+            )
             return embeddings
             
         except Exception as e:
             logger.error(f"Error embedding documents: {e}")
             raise
     
+    async def _embed_with_cache(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """Embed distinct texts, serving what we can from the on-disk cache"""
+        if self.embedding_cache is None:
+            embeddings, _ = await self._embed_uncached(texts)
+            return embeddings, 0
+        
+        # Only chunks whose content changed since the last run hit the provider
+        hashes = [self._content_hash(text) for text in texts]
+        cached = await asyncio.to_thread(self.embedding_cache.lookup, hashes, self.embedding_model)
+        
+        embeddings: List[Optional[List[float]]] = [cached.get(h) for h in hashes]
+        uncached_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if uncached_indices:
+            uncached_texts = [texts[i] for i in uncached_indices]
+            fresh, embedded = await self._embed_uncached(uncached_texts)
+            for i, embedding in zip(uncached_indices, fresh):
+                embeddings[i] = embedding
+            
+            # Only vectors the provider computed for these exact texts are persisted;
+            # near-duplicate reuses are approximations and must not become exact entries
+            persisted = [uncached_indices[j] for j in embedded]
+            if persisted:
+                await asyncio.to_thread(
+                    self.embedding_cache.write_many,
+                    [(hashes[i], embeddings[i]) for i in persisted],
+                    self.embedding_model
+                )
+        
+        return embeddings, len(texts) - len(uncached_indices)
+    
+    @staticmethod
+    def normalize_batch(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize the rows of a float32 matrix in place"""
+        if vectors.size:
+            norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+            np.maximum(norms, 1e-12, out=norms)
+            vectors /= norms[:, None]
+        return vectors
+    
+    def _content_hash(self, text: str) -> bytes:
+        """Cache key (32-byte BLAKE3 digest) for a chunk embedded with the current model"""
+        hasher = blake3(self._model_key_prefix)
+        hasher.update(text.encode('utf-8'))
+        return hasher.digest()
+    
+    async def _embed_uncached(self, texts: List[str]) -> Tuple[List[List[float]], List[int]]:
+        """Embed texts missing from the exact cache, reusing near-duplicate vectors if enabled
+        
+        Returns the vectors and the indices the provider actually embedded.
+        """
+        if self.near_duplicate_cache is None:
+            return await self._embed_texts(texts), list(range(len(texts)))
+        
+        embeddings = [self.near_duplicate_cache.lookup(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            fresh = await self._embed_texts([texts[i] for i in missing])
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+                self.near_duplicate_cache.add(texts[i], embedding)
+        
+        return embeddings, missing
+    
+    async def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with the configured provider"""
+        if self.embedding_model.startswith("text-embedding"):
+            return await self._embed_with_openai(texts)
+        return await self._embed_with_sentence_transformers(texts)
+    
     async def _embed_with_openai(self, texts: List[str]) -> List[List[float]]:
         """Embed texts using OpenAI API"""
         try:
+            if self.token_limiter is not None:
+                # ~4 characters per token is close enough for pacing
+                await self.token_limiter.acquire(sum(len(text) for text in texts) // 4 + 1)
+            
             response = await self.openai_client.embeddings.create(
                 model=self.embedding_model,
                 input=texts
@@ -70,13 +183,55 @@ class EmbeddingService:
         loop = asyncio.get_event_loop()
         embeddings = await loop.run_in_executor(
             None, 
-            self.embeddings.embed_documents, 
+            self._encode_local, 
             texts
         )
         return embeddings
     
+    def _encode_local(self, texts: List[str]) -> List[List[float]]:
+        """Encode texts with the local SentenceTransformer model (blocking)"""
+        vectors = self.embeddings.encode(
+            texts,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return vectors.astype(np.float32).tolist()
+    
     async def embed_query(self, query: str) -> List[float]:
-        """Embed a single query"""
+        """Embed a single query (memoized per model and query text)"""
+        key = self._content_hash(query)
+        
+        embedding = self._query_cache.get(key)
+        if embedding is not None:
+            self._query_cache.move_to_end(key)
+            return embedding
+        
+        lock = self._query_locks.get(key)
+        if lock is None:
+            lock = self._query_locks[key] = asyncio.Lock()
+        
+        try:
+            async with lock:
+                # Another waiter may have filled the cache while we were queued
+                embedding = self._query_cache.get(key)
+                if embedding is not None:
+                    self._query_cache.move_to_end(key)
+                    return embedding
+                
+                embedding = await self._embed_query_uncached(query)
+                
+                self._query_cache[key] = embedding
+                if len(self._query_cache) > self._query_cache_cap:
+                    self._query_cache.popitem(last=False)
+                return embedding
+        finally:
+            if not lock.locked() and self._query_locks.get(key) is lock:
+                del self._query_locks[key]
+    
+    async def _embed_query_uncached(self, query: str) -> List[float]:
+        """Embed a single query with the configured provider"""
         try:
             if self.embedding_model.startswith("text-embedding"):
                 response = await self.openai_client.embeddings.create(
@@ -86,28 +241,43 @@ class EmbeddingService:
                 return response.data[0].embedding
             else:
                 loop = asyncio.get_event_loop()
-                embedding = await loop.run_in_executor(
+                embeddings = await loop.run_in_executor(
                     None,
-                    self.embeddings.embed_query,
-                    query
+                    self._encode_local,
+                    [query]
                 )
-                return embedding
+                return embeddings[0]
         except Exception as e:
             logger.error(f"Error embedding query: {e}")
             raise
     
     async def embed_documents_async(self, documents: List[Document]) -> List[Document]:
-        """Embed documents asynchronously in batches"""
-        all_embeddings = []
+        """Embed documents asynchronously in concurrent batches
         
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i + self.batch_size]
-            batch_embeddings = await self.embed_documents_batch(batch)
-            all_embeddings.extend(batch_embeddings)
+        Returns the embedded documents; blank ones are dropped.
+        """
+        documents = [doc for doc in documents if doc.page_content and not doc.page_content.isspace()]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        total_batches = (len(documents) - 1) // self.batch_size + 1
+        
+        async def embed_batch(batch_num: int, batch: List[Document]) -> np.ndarray:
+            async with semaphore:
+                batch_embeddings = await self.embed_documents_batch(batch)
+            logger.info(f"Embedded batch {batch_num}/{total_batches}")
             
-            logger.info(f"Embedded batch {i//self.batch_size + 1}/{(len(documents)-1)//self.batch_size + 1}")
+            # Unit-normalize the whole batch as one float32 matrix, then keep it
+            # as float16 (2 bytes/element instead of a boxed Python float each);
+            # vector stores get float32 at push time
+            vectors = self.normalize_batch(np.asarray(batch_embeddings, dtype=np.float32))
+            return vectors.astype(np.float16)
+        
+        results = await asyncio.gather(*[
+            embed_batch(i // self.batch_size + 1, documents[i:i + self.batch_size])
+            for i in range(0, len(documents), self.batch_size)
+        ])
         
         # Add embeddings to documents
+        all_embeddings = (row for vectors in results for row in vectors)
         for doc, embedding in zip(documents, all_embeddings):
             doc.metadata["embedding"] = embedding
         
@@ -2,8 +2,8 @@ import asyncio
 import logging
 from typing import List, Dict, Any, Optional, Tuple
 import structlog
-import hashlib
-import json
+import orjson
+import xxhash
 from datetime import datetime
 from pathlib import Path
 
@@ -17,7 +17,8 @@ class EmbeddingVersionManager:
     def __init__(self):
         self.embedding_service = EmbeddingService()
         self.vector_store = VectorStoreManager()
-        self.version_metadata = {}
+        self.versions_path = Path(settings.embedding_versions_path)
+        self.version_metadata = self._load_version_metadata()
     
     def get_model_info(self, model_name: str) -> Dict[str, Any]:
         """Get information about an embedding model"""
@@ -59,7 +60,21 @@ class EmbeddingVersionManager:
     def _compute_model_hash(self, model_name: str, dimension: int) -> str:
         """Compute hash for model identification"""
         model_info = f"{model_name}:{dimension}:{settings.embedding_batch_size}"
-        return hashlib.sha256(model_info.encode()).hexdigest()[:16]
+        return xxhash.xxh3_128_hexdigest(model_info)[:16]
+    
+    def _load_version_metadata(self) -> Dict[str, Any]:
+        """Load persisted per-collection version metadata"""
+        try:
+            if self.versions_path.exists():
+                return orjson.loads(self.versions_path.read_bytes())
+        except Exception as e:
+            logger.warning(f"Failed to load embedding version metadata: {e}")
+        return {}
+    
+    def _save_version_metadata(self):
+        """Persist per-collection version metadata"""
+        self.versions_path.parent.mkdir(parents=True, exist_ok=True)
+        self.versions_path.write_bytes(orjson.dumps(self.version_metadata, option=orjson.OPT_INDENT_2))
     
     async def validate_collection_compatibility(self, collection_name: str, 
                                               new_model: str) -> Dict[str, Any]:
@@ -148,18 +163,20 @@ class EmbeddingVersionManager:
             settings.embedding_model = new_model
             
             try:
-                # Re-embed all documents
+                # Re-embed all documents (unit-normalized, as on the ingestion path);
+                # blank documents come back dropped rather than with a zero vector
+                embedded_documents = []
                 new_embeddings = []
                 for i in range(0, len(documents), batch_size):
-                    batch = documents[i:i + batch_size]
-                    batch_embeddings = await self.embedding_service.embed_documents_batch(batch)
-                    new_embeddings.extend(batch_embeddings)
+                    batch = await self.embedding_service.embed_documents_async(documents[i:i + batch_size])
+                    embedded_documents.extend(batch)
+                    new_embeddings.extend(doc.metadata.pop("embedding") for doc in batch)
                     
                     logger.info(f"Processed batch {i//batch_size + 1}/{(len(documents)-1)//batch_size + 1}")
                 
                 # Store in new collection
                 success = await self.vector_store.add_documents(
-                    new_collection_name, documents, new_embeddings
+                    new_collection_name, embedded_documents, new_embeddings
                 )
                 
                 if success:
@@ -169,7 +186,7 @@ class EmbeddingVersionManager:
                         "migrated_from_model": old_model,
                         "migrated_to_model": new_model,
                         "migration_date": datetime.utcnow().isoformat(),
-                        "document_count": len(documents)
+                        "document_count": len(embedded_documents)
                     })
                     
                     logger.info(f"Successfully migrated collection to {new_collection_name}")
@@ -177,7 +194,7 @@ class EmbeddingVersionManager:
                     return {
                         "success": True,
                         "new_collection_name": new_collection_name,
-                        "migrated_documents": len(documents),
+                        "migrated_documents": len(embedded_documents),
                         "old_model": old_model,
                         "new_model": new_model
                     }
@@ -212,7 +229,8 @@ class EmbeddingVersionManager:
     async def _update_collection_metadata(self, collection_name: str, metadata: Dict[str, Any]):
         """Update collection metadata"""
         try:
-            # This would update collection metadata
+            self.version_metadata[collection_name] = metadata
+            await asyncio.to_thread(self._save_version_metadata)
             logger.info(f"Updated collection metadata for {collection_name}: {metadata}")
             
         except Exception as e:
@@ -1,14 +1,113 @@
 import logging
+import os
+import re
+from collections import OrderedDict
+from functools import cache
 from typing import List, Dict, Any, Optional, Tuple
 import structlog
 from pydantic import BaseModel, Field
 import tiktoken
+import ahocorasick
+from xxhash import xxh3_64_intdigest
 
 logger = structlog.get_logger()
 
+# Memoized token counts, keyed by (xxh3_64 of text, length) so only ints are kept
+_TOKEN_COUNT_CACHE_SIZE = 4096
+# Contexts are assembled from retrieved chunks joined by blank lines
+_CHUNK_SEPARATOR = "\n\n"
+_TOKENIZER_THREADS = os.cpu_count() or 1
+# cl100k averages ~4 characters per token on English text; size gates only
+# run BPE when the character estimate is within this band of the limit
+_CHARS_PER_TOKEN = 4
+_ESTIMATE_REJECT_RATIO = 1.3
+
+CITATION_PATTERNS = [
+    "According to Source",
+    "Source",
+    "Document",
+    "As mentioned in",
+    "Based on the provided"
+]
+
+UNVERIFIABLE_PHRASES = [
+    "I believe", "I think", "In my opinion", "It seems like",
+    "Probably", "Maybe", "Perhaps", "I assume"
+]
+
+PROMPT_TEMPLATE = """You are a helpful AI assistant with access to a knowledge base. Answer the following question using ONLY the provided context.
+
+IMPORTANT RULES:
+1. You MUST cite your sources using "According to Source X..." format
+2. If you cannot find information in the provided context, say "I don't have enough information in the provided context to answer this question accurately"
+3. Do NOT make claims that cannot be verified from the provided sources
+4. If the context is insufficient, acknowledge this limitation
+5. Be precise and factual in your response
+6. Keep your response concise but comprehensive
+
+Question: {question}
+
+Context from {source_count} sources:
+{context}
+
+Sources:
+{sources}
+
+Answer (with citations):"""
+
+@cache
+def _cl100k() -> tiktoken.Encoding:
+    """Shared cl100k_base encoding, loaded once per process"""
+    return tiktoken.get_encoding("cl100k_base")
+
+# Patterns of the form \b(?:word|word)\b reduce to plain literal alternatives
+_LITERAL_ALTERNATION_RE = re.compile(r"\\b\(\?:(\w+(?:\|\w+)*)\)\\b")
+
+def _literal_anchors(patterns: List[str]) -> Optional[List[str]]:
+    """Lowercased literals that every match of the patterns must contain
+    
+    Returns None when any pattern is not a plain word alternation, in which
+    case no prefilter can be derived.
+    """
+    anchors = []
+    for pattern in patterns:
+        match = _LITERAL_ALTERNATION_RE.fullmatch(pattern)
+        if match is None:
+            return None
+        anchors.extend(word.lower() for word in match.group(1).split("|"))
+    return anchors
+
+def _build_automaton(patterns: List[str]) -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton that finds any of the patterns in one pass"""
+    automaton = ahocorasick.Automaton()
+    for pattern in patterns:
+        automaton.add_word(pattern, pattern)
+    automaton.make_automaton()
+    return automaton
+
+def _fits_by_length(texts: Tuple[str, ...], limit: int) -> bool:
+    """True when the texts together provably fit in limit tokens without encoding"""
+    length = sum(len(text) for text in texts)
+    return length * 4 <= limit or (length <= limit and all(text.isascii() for text in texts))
+
+def _size_gate(text: str, limit: int) -> Tuple[Optional[bool], int]:
+    """Decide a token-limit check from length alone when possible
+    
+    Returns (True, 0) when the text provably fits (every token covers at least
+    one UTF-8 byte), (False, estimate) when the estimate is far over the limit,
+    and (None, 0) when only an exact count can decide.
+    """
+    if _fits_by_length((text,), limit):
+        return True, 0
+    estimate = len(text) // _CHARS_PER_TOKEN
+    if estimate > _ESTIMATE_REJECT_RATIO * limit:
+        return False, estimate
+    return None, 0
+
 class GuardrailConfig(BaseModel):
     max_tokens: int = Field(default=4000, description="Maximum tokens per response")
     max_context_tokens: int = Field(default=8000, description="Maximum context tokens")
+    max_prompt_tokens: Optional[int] = Field(default=None, description="Maximum tokens for the whole prompt (unset: no limit)")
     require_citations: bool = Field(default=True, description="Require citations in responses")
     forbid_unverifiable: bool = Field(default=True, description="Forbid unverifiable claims")
     min_confidence_threshold: float = Field(default=0.3, description="Minimum confidence threshold")
@@ -17,15 +116,69 @@ class GuardrailConfig(BaseModel):
 class GuardrailService:
     def __init__(self, config: GuardrailConfig = None):
         self.config = config or GuardrailConfig()
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.encoding = _cl100k()
+        self._token_counts: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._separator_tokens = len(self.encoding.encode_ordinary(_CHUNK_SEPARATOR))
+        # Static part of the prompt (rules and headings), counted once
+        self._rules_token_count = len(self.encoding.encode_ordinary(
+            PROMPT_TEMPLATE.format(question="", source_count="", context="", sources="")
+        ))
+        self._citation_automaton = _build_automaton(CITATION_PATTERNS)
+        # Hedging is matched case-insensitively ("i think" mid-sentence); citation
+        # markers stay case-sensitive so e.g. "resource" is not read as "Source"
+        self._unverifiable_automaton = _build_automaton([phrase.lower() for phrase in UNVERIFIABLE_PHRASES])
     
     def count_tokens(self, text: str) -> int:
-        """Count tokens in text"""
-        return len(self.encoding.encode(text))
+        """Count tokens in text (memoized, so repeated prompts and chunks skip BPE)"""
+        key = (xxh3_64_intdigest(text), len(text))
+        count = self._token_counts.get(key)
+        if count is not None:
+            self._token_counts.move_to_end(key)
+            return count
+        
+        count = len(self.encoding.encode_ordinary(text))
+        self._token_counts[key] = count
+        if len(self._token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+            self._token_counts.popitem(last=False)
+        return count
+    
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for many texts, encoding all cache misses in one batch call"""
+        keys = [(xxh3_64_intdigest(text), len(text)) for text in texts]
+        counts = [self._token_counts.get(key) for key in keys]
+        
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = self.encoding.encode_ordinary_batch(
+                [texts[i] for i in missing], num_threads=_TOKENIZER_THREADS
+            )
+            for i, ids in zip(missing, encoded):
+                counts[i] = self._token_counts[keys[i]] = len(ids)
+            while len(self._token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+                self._token_counts.popitem(last=False)
+        
+        return counts
+    
+    def count_context_tokens(self, context: str) -> int:
+        """Count context tokens as the sum of memoized per-chunk counts
+        
+        Retrieved chunks recur across requests even when the assembled context
+        differs, so counting chunk by chunk lets most of the work hit the cache.
+        """
+        chunks = context.split(_CHUNK_SEPARATOR)
+        if len(chunks) == 1:
+            return self.count_tokens(context)
+        return sum(self.count_tokens_batch(chunks)) + (len(chunks) - 1) * self._separator_tokens
     
     def validate_context_size(self, context: str) -> Tuple[bool, str]:
         """Validate context size against limits"""
-        token_count = self.count_tokens(context)
+        fits, estimate = _size_gate(context, self.config.max_context_tokens)
+        if fits:
+            return True, ""
+        if fits is False:
+            return False, f"Context too large: ~{estimate} tokens (max: {self.config.max_context_tokens})"
+        
+        token_count = self.count_context_tokens(context)
         
         if token_count > self.config.max_context_tokens:
             return False, f"Context too large: {token_count} tokens (max: {self.config.max_context_tokens})"
@@ -34,6 +187,12 @@ class GuardrailService:
     
     def validate_response_size(self, response: str) -> Tuple[bool, str]:
         """Validate response size against limits"""
+        fits, estimate = _size_gate(response, self.config.max_tokens)
+        if fits:
+            return True, ""
+        if fits is False:
+            return False, f"Response too large: ~{estimate} tokens (max: {self.config.max_tokens})"
+        
         token_count = self.count_tokens(response)
         
         if token_count > self.config.max_tokens:
@@ -43,96 +202,126 @@ class GuardrailService:
     
     def create_guardrail_prompt(self, question: str, context: str, sources: List[Dict]) -> str:
         """Create a prompt with guardrails"""
-        
-        # Validate context size
-        is_valid, error = self.validate_context_size(context)
-        if not is_valid:
-            logger.warning(f"Context size validation failed: {error}")
-            # Truncate context if too large
-            context = self._truncate_context(context)
-        
         # Limit sources
         limited_sources = sources[:self.config.max_sources]
+        formatted_sources = self._format_sources(limited_sources)
         
-        prompt = f"""You are a helpful AI assistant with access to a knowledge base. Answer the following question using ONLY the provided context.
-
-IMPORTANT RULES:
-1. You MUST cite your sources using "According to Source X..." format
-2. If you cannot find information in the provided context, say "I don't have enough information in the provided context to answer this question accurately"
-3. Do NOT make claims that cannot be verified from the provided sources
-4. If the context is insufficient, acknowledge this limitation
-5. Be precise and factual in your response
-6. Keep your response concise but comprehensive
-
-Question: {question}
-
-Context from {len(limited_sources)} sources:
-{context}
-
-Sources:
-{self._format_sources(limited_sources)}
-
-Answer (with citations):"""
-
-        return prompt
+        # max_context_tokens budgets the retrieved context only; the context is
+        # encoded at most once and the ids are reused for the cut
+        context_ids = None
+        fits, _ = _size_gate(context, self.config.max_context_tokens)
+        if not fits:
+            context_ids = self.encoding.encode_ordinary(context)
+            if len(context_ids) > self.config.max_context_tokens:
+                logger.warning(
+                    f"Context size validation failed: {len(context_ids)} tokens "
+                    f"(max: {self.config.max_context_tokens})"
+                )
+                context = self._truncate_context(context, context_ids)
+                context_ids = None
+        
+        if self.config.max_prompt_tokens is not None:
+            context = self._fit_prompt(question, context, formatted_sources, context_ids)
+        
+        return PROMPT_TEMPLATE.format(
+            question=question,
+            source_count=len(limited_sources),
+            context=context,
+            sources=formatted_sources
+        )
     
-    def _truncate_context(self, context: str) -> str:
-        """Truncate context to fit within token limits"""
-        # Simple truncation - in production, you'd want smarter chunking
-        max_chars = self.config.max_context_tokens * 4  # Rough estimate
-        if len(context) > max_chars:
-            context = context[:max_chars] + "..."
-        return context
+    def _fit_prompt(self, question: str, context: str, formatted_sources: str,
+                    context_ids: Optional[List[int]] = None) -> str:
+        """Cut the context so the whole prompt fits max_prompt_tokens
+        
+        The variable parts are encoded in one batch call (skipped when length
+        alone proves they fit); the rules are counted once at init.
+        """
+        budget = self.config.max_prompt_tokens - self._rules_token_count
+        if _fits_by_length((question, context, formatted_sources), budget):
+            return context
+        
+        texts = [question, formatted_sources] if context_ids is not None else [question, formatted_sources, context]
+        encoded = self.encoding.encode_ordinary_batch(texts, num_threads=_TOKENIZER_THREADS)
+        if context_ids is None:
+            context_ids = encoded[2]
+        overhead = len(encoded[0]) + len(encoded[1])
+        if overhead + len(context_ids) <= budget:
+            return context
+        
+        logger.warning(
+            f"Prompt size validation failed: "
+            f"{self._rules_token_count + overhead + len(context_ids)} tokens "
+            f"(max: {self.config.max_prompt_tokens})"
+        )
+        return self._truncate_context(context, context_ids, max(budget - overhead, 0))
+    
+    def _truncate_context(self, context: str, ids: Optional[List[int]] = None,
+                          max_tokens: Optional[int] = None) -> str:
+        """Truncate context to fit within token limits (exact cut on token boundaries)"""
+        if max_tokens is None:
+            max_tokens = self.config.max_context_tokens
+        if ids is None:
+            ids = self.encoding.encode_ordinary(context)
+        if len(ids) <= max_tokens:
+            return context
+        return self.encoding.decode(ids[:max_tokens]) + "..."
     
     def _format_sources(self, sources: List[Dict]) -> str:
         """Format sources for the prompt"""
-        formatted = []
-        for i, source in enumerate(sources, 1):
-            source_info = f"Source {i}: {source.get('source', 'Unknown')}"
-            if 'relevance_score' in source:
-                source_info += f" (Relevance: {source['relevance_score']:.2f})"
-            formatted.append(source_info)
-        return "\n".join(formatted)
-    
-    def validate_response(self, response: str, sources: List[Dict]) -> Tuple[bool, List[str]]:
-        """Validate response against guardrails"""
+        return "\n".join(
+            f"Source {i}: {source.get('source', 'Unknown')}"
+            + (f" (Relevance: {source['relevance_score']:.2f})" if 'relevance_score' in source else "")
+            for i, source in enumerate(sources, 1)
+        )
+    
+    def validate_response(self, response: str, sources: List[Dict],
+                          fast_mode: bool = True) -> Tuple[bool, List[str]]:
+        """Validate response against guardrails
+        
+        Checks run cheapest first; in fast_mode the first issue is returned
+        immediately, otherwise every issue is collected for diagnostics.
+        """
         issues = []
         
-        # Check response size
-        is_valid, error = self.validate_response_size(response)
-        if not is_valid:
-            issues.append(error)
+        # Check minimum confidence
+        confidence = getattr(self, '_last_confidence', None)
+        if confidence is not None and confidence < self.config.min_confidence_threshold:
+            issues.append(f"Confidence too low: {confidence:.2f}")
+            if fast_mode:
+                return False, issues
+        
+        # Check response size from length alone when possible
+        fits, estimate = _size_gate(response, self.config.max_tokens)
+        if fits is False:
+            issues.append(f"Response too large: ~{estimate} tokens (max: {self.config.max_tokens})")
+            if fast_mode:
+                return False, issues
         
         # Check for citations if required
-        if self.config.require_citations:
-            if not self._has_citations(response):
-                issues.append("Response must include citations")
+        if self.config.require_citations and not self._has_citations(response):
+            issues.append("Response must include citations")
+            if fast_mode:
+                return False, issues
         
         # Check for unverifiable claims
         if self.config.forbid_unverifiable:
-            unverifiable_phrases = [
-                "I believe", "I think", "In my opinion", "It seems like",
-                "Probably", "Maybe", "Perhaps", "I assume"
-            ]
-            if any(phrase in response for phrase in unverifiable_phrases):
+            if next(self._unverifiable_automaton.iter(response.lower()), None) is not None:
                 issues.append("Response contains unverifiable claims")
+                if fast_mode:
+                    return False, issues
         
-        # Check minimum confidence
-        if hasattr(self, '_last_confidence') and self._last_confidence < self.config.min_confidence_threshold:
-            issues.append(f"Confidence too low: {self._last_confidence:.2f}")
+        # Exact token count only when the length check was inconclusive
+        if fits is None:
+            token_count = self.count_tokens(response)
+            if token_count > self.config.max_tokens:
+                issues.append(f"Response too large: {token_count} tokens (max: {self.config.max_tokens})")
         
         return len(issues) == 0, issues
     
     def _has_citations(self, response: str) -> bool:
         """Check if response contains citations"""
-        citation_patterns = [
-            "According to Source",
-            "Source",
-            "Document",
-            "As mentioned in",
-            "Based on the provided"
-        ]
-        return any(pattern in response for pattern in citation_patterns)
+        return next(self._citation_automaton.iter(response), None) is not None
     
     def create_fallback_response(self, question: str, reason: str) -> str:
         """Create a fallback response when guardrails fail"""
@@ -150,7 +339,6 @@ If you continue to have issues, please contact support."""
 class StreamingResponse:
     def __init__(self, max_tokens: int = 4000):
         self.max_tokens = max_tokens
-        self.encoding = tiktoken.get_encoding("cl100k_base")
         self.tokens_generated = 0
     
     def should_continue(self, new_tokens: int) -> bool:
@@ -169,14 +357,28 @@ class ContentFilter:
             r'\b(?:hack|exploit|vulnerability)\b',
             # Add more patterns as needed
         ]
+        
+        # One case-insensitive alternation scans the text once for every pattern;
+        # each pattern gets a named group so the match can be attributed
+        self._combined = re.compile(
+            "|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(self.blocked_patterns)),
+            re.IGNORECASE
+        )
+        # Literal prefilter: text containing none of the pattern words is safe
+        # without running the word-boundary regex
+        anchors = _literal_anchors(self.blocked_patterns)
+        self._literal_automaton = _build_automaton(anchors) if anchors else None
     
     def is_safe(self, text: str) -> Tuple[bool, str]:
         """Check if content is safe"""
-        import re
+        if self._literal_automaton is not None:
+            if next(self._literal_automaton.iter(text.lower()), None) is None:
+                return True, ""
         
-        for pattern in self.blocked_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return False, f"Content blocked due to pattern: {pattern}"
+        match = self._combined.search(text)
+        if match is not None:
+            pattern = self.blocked_patterns[int(match.lastgroup[1:])]
+            return False, f"Content blocked due to pattern: {pattern}"
         
         return True, ""
     
@@ -1,9 +1,10 @@
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import sys
+from typing import List, Dict, Any, Awaitable, Hashable, Optional, Tuple
 import numpy as np
 from elasticsearch import AsyncElasticsearch
-from elasticsearch.helpers import async_bulk
+from elasticsearch.helpers import async_streaming_bulk
 import structlog
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -12,6 +13,13 @@ from app.core.config import settings
 
 logger = structlog.get_logger()
 
+# Fields searched and returned by BM25 queries, shared across requests
+_BM25_FIELDS = ["text^2", "file_name^1.5"]
+_BM25_SOURCE_FIELDS = ["text", "source", "chunk_index", "file_name", "file_type", "metadata"]
+# Bulk indexing: chunks are small, so larger batches amortize HTTP overhead
+_BULK_CHUNK_SIZE = 2000
+_BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
 class HybridSearchEngine:
     def __init__(self):
         self.elasticsearch_client = None
@@ -48,24 +56,30 @@ class HybridSearchEngine:
                 logger.info(f"Index {index_name} already exists")
                 return True
             
-            # Create index with mapping
+            # Create index with mapping. BM25 only needs term frequencies (no
+            # phrase queries), and exact-match fields only need doc IDs
+            exact_match = {"type": "keyword", "doc_values": True, "norms": False, "index_options": "docs"}
             mapping = {
                 "mappings": {
                     "properties": {
                         "text": {
                             "type": "text",
                             "analyzer": "standard",
+                            "similarity": "BM25",
+                            "index_options": "freqs",
+                            "norms": True,
                             "fields": {
                                 "keyword": {
-                                    "type": "keyword"
+                                    "type": "keyword",
+                                    "ignore_above": 256
                                 }
                             }
                         },
-                        "source": {"type": "keyword"},
+                        "source": exact_match,
                         "chunk_index": {"type": "integer"},
-                        "file_name": {"type": "keyword"},
-                        "file_type": {"type": "keyword"},
-                        "collection": {"type": "keyword"},
+                        "file_name": exact_match,
+                        "file_type": exact_match,
+                        "collection": exact_match,
                         "metadata": {"type": "object"},
                         "created_at": {"type": "date"}
                     }
@@ -105,77 +119,73 @@ class HybridSearchEngine:
         try:
             index_name = f"{self.index_name}_{collection_name}"
             
-            # Prepare documents for bulk indexing
-            actions = []
-            for doc in documents:
-                action = {
-                    "_index": index_name,
-                    "_id": doc.get("id"),
-                    "_source": {
-                        "text": doc.get("text", ""),
-                        "source": doc.get("source", ""),
-                        "chunk_index": doc.get("chunk_index", 0),
-                        "file_name": doc.get("file_name", ""),
-                        "file_type": doc.get("file_type", ""),
-                        "collection": collection_name,
-                        "metadata": doc.get("metadata", {}),
-                        "created_at": doc.get("created_at")
+            # Actions are generated lazily so only one bulk chunk is in memory
+            def gen_actions():
+                for doc in documents:
+                    yield {
+                        "_index": index_name,
+                        "_id": doc.get("id"),
+                        "_source": {
+                            "text": doc.get("text", ""),
+                            "source": doc.get("source", ""),
+                            "chunk_index": doc.get("chunk_index", 0),
+                            "file_name": doc.get("file_name", ""),
+                            "file_type": doc.get("file_type", ""),
+                            "collection": collection_name,
+                            "metadata": doc.get("metadata", {}),
+                            "created_at": doc.get("created_at")
+                        }
                     }
-                }
-                actions.append(action)
             
-            # Bulk index
-            success, failed = await async_bulk(
+            # Stream bulk requests
+            success = failed = 0
+            async for ok, _ in async_streaming_bulk(
                 self.elasticsearch_client,
-                actions,
-                chunk_size=1000,
+                gen_actions(),
+                chunk_size=_BULK_CHUNK_SIZE,
+                max_chunk_bytes=_BULK_MAX_CHUNK_BYTES,
+                raise_on_error=False,
                 request_timeout=60
-            )
+            ):
+                if ok:
+                    success += 1
+                else:
+                    failed += 1
             
-            logger.info(f"Indexed {success} documents, {len(failed)} failed")
-            return len(failed) == 0
+            logger.info(f"Indexed {success} documents, {failed} failed")
+            return failed == 0
             
         except Exception as e:
             logger.error(f"Error indexing documents: {e}")
             return False
     
     async def bm25_search(self, collection_name: str, query: str, top_k: int = 10, 
-                         filters: Optional[Dict] = None) -> List[Tuple[Dict[str, Any], float]]:
-        """Perform BM25 keyword search"""
+                         filters: Optional[Dict] = None,
+                         fuzziness: Optional[str] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """Perform BM25 keyword search (fuzzy matching only when fuzziness is given)"""
         if not self.elasticsearch_client:
             return []
         
         try:
             index_name = f"{self.index_name}_{collection_name}"
             
-            # Build query
+            # Build query from the shared field lists; exact-match filters go in
+            # filter context so they are cached and never scored
+            multi_match = {"query": query, "fields": _BM25_FIELDS, "type": "best_fields"}
+            if fuzziness:
+                multi_match["fuzziness"] = fuzziness
+            
+            bool_query: Dict[str, Any] = {"must": [{"multi_match": multi_match}]}
+            if filters:
+                bool_query["filter"] = [{"term": {key: value}} for key, value in filters.items()]
+            
             es_query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "multi_match": {
-                                    "query": query,
-                                    "fields": ["text^2", "file_name^1.5"],
-                                    "type": "best_fields",
-                                    "fuzziness": "AUTO"
-                                }
-                            }
-                        ]
-                    }
-                },
+                "query": {"bool": bool_query},
                 "size": top_k,
-                "_source": ["text", "source", "chunk_index", "file_name", "file_type", "metadata"]
+                "track_total_hits": False,
+                "_source": _BM25_SOURCE_FIELDS
             }
             
-            # Add filters
-            if filters:
-                es_query["query"]["bool"]["filter"] = []
-                for key, value in filters.items():
-                    es_query["query"]["bool"]["filter"].append({
-                        "term": {key: value}
-                    })
-            
             # Execute search
             response = await self.elasticsearch_client.search(
                 index=index_name,
@@ -195,6 +205,25 @@ class HybridSearchEngine:
             logger.error(f"Error in BM25 search: {e}")
             return []
     
+    async def hybrid_search_full(self, collection_name: str, query: str,
+                                 vector_search: Awaitable[List[Tuple[Any, float]]],
+                                 top_k: int = 10,
+                                 candidate_k: Optional[int] = None,
+                                 semantic_weight: float = 0.7,
+                                 keyword_weight: float = 0.3,
+                                 filters: Optional[Dict] = None) -> List[Tuple[Any, float]]:
+        """Run the caller's vector search and BM25 search concurrently, then blend them"""
+        vector_results, bm25_results = await asyncio.gather(
+            vector_search,
+            self.bm25_search(collection_name, query, candidate_k or top_k * 2, filters)
+        )
+        
+        return await self.blend(
+            query, vector_results, bm25_results, top_k,
+            semantic_weight=semantic_weight,
+            keyword_weight=keyword_weight
+        )
+    
     async def blend(self, query: str, vector_results: List[Tuple[Any, float]], 
                    bm25_results: List[Tuple[Dict[str, Any], float]], 
                    top_k: int = 10, 
@@ -207,78 +236,82 @@ class HybridSearchEngine:
                 return vector_results[:top_k]
             
             # Normalize scores
-            vector_scores = [score for _, score in vector_results]
-            bm25_scores = [score for _, score in bm25_results]
+            normalized_vector = self._min_max_normalize(vector_results)
+            normalized_bm25 = self._min_max_normalize(bm25_results)
             
-            if vector_scores:
-                max_vector = max(vector_scores)
-                min_vector = min(vector_scores)
-                vector_range = max_vector - min_vector if max_vector != min_vector else 1
-                normalized_vector = [(score - min_vector) / vector_range for score in vector_scores]
-            else:
-                normalized_vector = []
-            
-            if bm25_scores:
-                max_bm25 = max(bm25_scores)
-                min_bm25 = min(bm25_scores)
-                bm25_range = max_bm25 - min_bm25 if max_bm25 != min_bm25 else 1
-                normalized_bm25 = [(score - min_bm25) / bm25_range for score in bm25_scores]
-            else:
-                normalized_bm25 = []
-            
-            # Create document ID to score mapping
-            doc_scores = {}
+            # Merge into parallel arrays with one slot per document id; a document
+            # returned more than once by either search keeps its best score there
+            capacity = len(vector_results) + len(bm25_results)
+            docs: List[Any] = []
+            slots: Dict[Hashable, int] = {}
+            vector_scores = np.zeros(capacity)
+            bm25_scores = np.zeros(capacity)
             
-            # Add vector scores
-            for i, (doc, score) in enumerate(vector_results):
-                doc_id = self._get_doc_id(doc)
-                if i < len(normalized_vector):
-                    doc_scores[doc_id] = {
-                        'doc': doc,
-                        'vector_score': normalized_vector[i],
-                        'bm25_score': 0.0
-                    }
-            
-            # Add BM25 scores
-            for i, (doc, score) in enumerate(bm25_results):
-                doc_id = self._get_doc_id(doc)
-                if doc_id in doc_scores:
-                    doc_scores[doc_id]['bm25_score'] = normalized_bm25[i] if i < len(normalized_bm25) else 0.0
-                else:
-                    doc_scores[doc_id] = {
-                        'doc': doc,
-                        'vector_score': 0.0,
-                        'bm25_score': normalized_bm25[i] if i < len(normalized_bm25) else 0.0
-                    }
+            for results, normalized, scores in ((vector_results, normalized_vector, vector_scores),
+                                                (bm25_results, normalized_bm25, bm25_scores)):
+                for (doc, _), score in zip(results, normalized):
+                    doc_id = self._get_doc_id(doc)
+                    slot = slots.get(doc_id)
+                    if slot is None:
+                        slot = slots[doc_id] = len(docs)
+                        docs.append(doc)
+                    if score > scores[slot]:
+                        scores[slot] = score
             
             # Calculate hybrid scores
-            hybrid_results = []
-            for doc_id, scores in doc_scores.items():
-                hybrid_score = (semantic_weight * scores['vector_score'] + 
-                              keyword_weight * scores['bm25_score'])
-                hybrid_results.append((scores['doc'], hybrid_score))
+            n = len(docs)
+            hybrid_scores = semantic_weight * vector_scores[:n] + keyword_weight * bm25_scores[:n]
             
-            # Sort by hybrid score
-            hybrid_results.sort(key=lambda x: x[1], reverse=True)
-            
-            return hybrid_results[:top_k]
+            # Select the top_k by hybrid score without sorting every candidate
+            top = self._top_k_indices(hybrid_scores, top_k)
+            return [(docs[i], float(hybrid_scores[i])) for i in top]
             
         except Exception as e:
             logger.error(f"Error in hybrid search blend: {e}")
             return vector_results[:top_k]
     
-    def _get_doc_id(self, doc) -> str:
-        """Generate document ID for deduplication"""
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the top_k scores, highest first (argpartition, then sort only those)"""
+        if top_k <= 0:
+            return np.empty(0, dtype=np.intp)
+        if top_k < scores.size:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(scores.size)
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+    
+    @staticmethod
+    def _min_max_normalize(results: List[Tuple[Any, float]]) -> np.ndarray:
+        """Min-max normalize result scores to [0, 1] in one vectorized pass"""
+        scores = np.fromiter((score for _, score in results), dtype=np.float64, count=len(results))
+        if not scores.size:
+            return scores
+        
+        score_range = np.ptp(scores)
+        scores -= scores.min()
+        if score_range:
+            scores /= score_range
+        return scores
+    
+    def _get_doc_id(self, doc) -> Hashable:
+        """Generate document ID for deduplication as a (source, chunk_index) tuple"""
         if hasattr(doc, 'metadata'):
-            source = doc.metadata.get('source', '')
-            chunk_index = doc.metadata.get('chunk_index', 0)
-            return f"{source}_{chunk_index}"
+            meta = doc.metadata
         elif isinstance(doc, dict):
-            source = doc.get('source', '')
-            chunk_index = doc.get('chunk_index', 0)
-            return f"{source}_{chunk_index}"
+            meta = doc
         else:
-            return str(hash(str(doc)))
+            return hash(str(doc))
+        
+        # Stores disagree on the chunk_index type (3 vs "3"); compare numerically
+        # when possible. Interned sources compare by identity when tuples collide
+        # in the merge dict
+        chunk_index = meta.get('chunk_index', 0)
+        try:
+            chunk_index = int(chunk_index)
+        except (TypeError, ValueError):
+            chunk_index = str(chunk_index)
+        return (sys.intern(str(meta.get('source', ''))), chunk_index)
     
     async def delete_index(self, collection_name: str) -> bool:
         """Delete Elasticsearch index"""
@@ -1,9 +1,11 @@
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass
+from typing import Awaitable, Iterable, List, Dict, Any, Optional, Set, Tuple
 import structlog
-import hashlib
 from datetime import datetime
+import numpy as np
+from langchain.schema import Document
 
 from app.core.vector_store import VectorStoreManager
 from app.core.embedding_service import EmbeddingService
@@ -13,6 +15,57 @@ from app.core.config import settings
 
 logger = structlog.get_logger()
 
+# Documents deduplicated and upserted per round trip in idempotent_upsert
+UPSERT_CHUNK_SIZE = 256
+# Cap on per-document skip details returned from one upsert
+_MAX_SKIPPED_DETAILS = 1000
+
+@dataclass(slots=True)
+class ChunkMeta:
+    """Per-chunk upsert metadata, kept slotted until a surviving Document is built"""
+    source: str
+    chunk_index: int
+    file_name: str
+    file_type: str
+    doc_title: str
+    section_title: str
+    page_num: int
+    created_at: str
+    extra: Dict[str, Any]
+    
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any], created_at: str) -> "ChunkMeta":
+        """Pick the fixed fields out of an upsert input document"""
+        return cls(
+            doc.get("source", "unknown"),
+            doc.get("chunk_index", 0),
+            doc.get("file_name", "unknown"),
+            doc.get("file_type", "unknown"),
+            doc.get("doc_title", "unknown"),
+            doc.get("section_title", "unknown"),
+            doc.get("page_num", 0),
+            created_at,
+            doc.get("metadata") or {}
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Flatten into Document metadata; the fixed fields override same-named extras"""
+        metadata = dict(self.extra)
+        metadata.update(
+            source=self.source,
+            chunk_index=self.chunk_index,
+            file_name=self.file_name,
+            file_type=self.file_type,
+            doc_title=self.doc_title,
+            section_title=self.section_title,
+            page_num=self.page_num,
+            created_at=self.created_at
+        )
+        return metadata
+
+# (contents, metadata records, dedup hashes) for one chunk of an upsert
+PreparedChunk = Tuple[List[str], List[ChunkMeta], List[bytes]]
+
 class IndexManager:
     def __init__(self):
         self.vector_store = VectorStoreManager()
@@ -20,81 +73,88 @@ class IndexManager:
         self.dedup_service = DeduplicationService()
         self.cache_service = CacheService()
         self.upsert_service = UpsertService(self.vector_store, self.dedup_service)
+        # Strong references to fire-and-forget side-effect tasks until they finish
+        self._background_tasks: Set[asyncio.Task] = set()
+    
+    def _run_in_background(self, coro: Awaitable) -> asyncio.Task:
+        """Schedule a side effect (cache invalidation) without awaiting it"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
     
     async def idempotent_upsert(self, collection_name: str, documents: List[Dict[str, Any]], 
-                               embeddings: List[List[float]], metadata: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Idempotent upsert with deduplication"""
+                               embeddings: np.ndarray, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Idempotent upsert with deduplication, streamed in chunks of UPSERT_CHUNK_SIZE"""
+        logger.info(f"Starting idempotent upsert for collection: {collection_name}")
+        
+        # One contiguous (N, dim) float32 block; per-chunk slices below are views
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        
+        prepared_chunks = await self._prepare_upsert(documents, datetime.utcnow().isoformat())
+        return await self._commit_upsert(collection_name, documents, embeddings, prepared_chunks, metadata)
+    
+    async def _prepare_upsert(self, documents: List[Dict[str, Any]],
+                              created_at: str) -> List[PreparedChunk]:
+        """Build content, metadata and dedup hashes per chunk (no I/O, no dedup lookups)"""
+        contents, metadatas = await asyncio.to_thread(self._build_records, documents, created_at)
+        
+        # Hash the whole batch in one call so the thread/process thresholds apply
+        # to its full size, then slice alongside the records
+        content_hashes = await self.dedup_service.compute_hashes_async(contents, metadatas)
+        return [
+            (contents[start:start + UPSERT_CHUNK_SIZE], metadatas[start:start + UPSERT_CHUNK_SIZE],
+             content_hashes[start:start + UPSERT_CHUNK_SIZE])
+            for start in range(0, len(documents), UPSERT_CHUNK_SIZE)
+        ]
+    
+    @staticmethod
+    def _build_records(documents: List[Dict[str, Any]], created_at: str) -> Tuple[List[str], List[ChunkMeta]]:
+        """Content and slotted metadata records for every input document"""
+        contents = [doc.get("content", "") for doc in documents]
+        metadatas = [ChunkMeta.from_document(doc, created_at) for doc in documents]
+        return contents, metadatas
+    
+    async def _commit_upsert(self, collection_name: str, documents: List[Dict[str, Any]],
+                             embeddings: np.ndarray, prepared_chunks: Iterable[PreparedChunk],
+                             metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Dedup-check and upsert prepared chunks one at a time, accumulating totals"""
         try:
-            logger.info(f"Starting idempotent upsert for collection: {collection_name}")
-            
-            # Prepare documents with content hashes
-            processed_docs = []
+            processed_total = 0
+            skipped_total = 0
+            upserted_total = 0
             skipped_docs = []
+            errors = []
             
-            for doc, embedding in zip(documents, embeddings):
-                # Create document object
-                from langchain.schema import Document
-                doc_obj = Document(
-                    page_content=doc.get("content", ""),
-                    metadata={
-                        **doc.get("metadata", {}),
-                        "source": doc.get("source", "unknown"),
-                        "chunk_index": doc.get("chunk_index", 0),
-                        "file_name": doc.get("file_name", "unknown"),
-                        "file_type": doc.get("file_type", "unknown"),
-                        "doc_title": doc.get("doc_title", "unknown"),
-                        "section_title": doc.get("section_title", "unknown"),
-                        "page_num": doc.get("page_num", 0),
-                        "created_at": datetime.utcnow().isoformat()
-                    }
+            for start, prepared in zip(range(0, len(documents), UPSERT_CHUNK_SIZE), prepared_chunks):
+                end = start + UPSERT_CHUNK_SIZE
+                processed, skipped, result = await self._upsert_chunk(
+                    collection_name, documents[start:end], embeddings[start:end], prepared
                 )
+                processed_total += processed
+                skipped_total += len(skipped)
+                upserted_total += result["upserted_documents"]
+                skipped_docs.extend(skipped[:_MAX_SKIPPED_DETAILS - len(skipped_docs)])
+                errors.extend(result.get("errors", []))
+            
+            if upserted_total > 0:
+                # Invalidate cache for this collection in the background
+                self._run_in_background(self.cache_service.invalidate_collection_cache(collection_name))
                 
-                # Check if document already exists
-                is_dup, existing_id = self.dedup_service.is_duplicate(doc_obj)
-                
-                if is_dup:
-                    skipped_docs.append({
-                        "source": doc.get("source"),
-                        "chunk_index": doc.get("chunk_index"),
-                        "existing_id": existing_id,
-                        "reason": "duplicate"
-                    })
-                    logger.debug(f"Skipped duplicate document: {doc.get('source')}")
-                else:
-                    # Add content hash to metadata
-                    content_hash = self._compute_content_hash(doc_obj)
-                    doc_obj.metadata["content_hash"] = content_hash
-                    
-                    processed_docs.append((doc_obj, embedding))
-            
-            # Upsert unique documents
-            if processed_docs:
-                unique_docs = [doc for doc, _ in processed_docs]
-                unique_embeddings = [emb for _, emb in processed_docs]
-                
-                success = await self.upsert_service.upsert_documents(
-                    collection_name, unique_docs, unique_embeddings
-                )
-                
-                if success["upserted_documents"] > 0:
-                    # Invalidate cache for this collection
-                    await self.cache_service.invalidate_collection_cache(collection_name)
-                    
-                    logger.info(f"Upserted {success['upserted_documents']} unique documents")
-            else:
-                success = {"upserted_documents": 0, "errors": []}
+                logger.info(f"Upserted {upserted_total} unique documents")
             
-            # Update collection metadata
+            # Update collection metadata before reporting success; only cache
+            # invalidation is left to the background
             await self._update_collection_metadata(collection_name, metadata)
             
             return {
                 "success": True,
                 "total_documents": len(documents),
-                "processed_documents": len(processed_docs),
-                "skipped_documents": len(skipped_docs),
-                "upserted_documents": success["upserted_documents"],
+                "processed_documents": processed_total,
+                "skipped_documents": skipped_total,
+                "upserted_documents": upserted_total,
                 "skipped_details": skipped_docs,
-                "errors": success.get("errors", [])
+                "errors": errors
             }
             
         except Exception as e:
@@ -108,6 +168,48 @@ class IndexManager:
                 "upserted_documents": 0
             }
     
+    async def _upsert_chunk(self, collection_name: str, documents: List[Dict[str, Any]],
+                            embeddings: np.ndarray,
+                            prepared: PreparedChunk) -> Tuple[int, List[Dict[str, Any]], Dict[str, Any]]:
+        """Dedup and upsert one chunk; returns (processed count, skipped details, upsert result)"""
+        contents, metadatas, content_hashes = prepared
+        
+        # Check which documents already exist in one batched lookup
+        existing_ids = self.dedup_service.find_existing(content_hashes)
+        
+        # Document objects are only built for the survivors
+        unique_docs = []
+        unique_rows = []
+        unique_hashes = []
+        skipped_docs = []
+        for i, (doc, content, chunk_meta, existing_id) in enumerate(zip(
+            documents, contents, metadatas, existing_ids
+        )):
+            if existing_id is not None:
+                skipped_docs.append({
+                    "source": doc.get("source"),
+                    "chunk_index": doc.get("chunk_index"),
+                    "existing_id": existing_id,
+                    "reason": "duplicate"
+                })
+                logger.debug(f"Skipped duplicate document: {doc.get('source')}")
+            else:
+                # Store the dedup digest itself, so nothing is hashed again downstream
+                document_metadata = chunk_meta.to_dict()
+                document_metadata["content_hash"] = content_hashes[i].hex()
+                unique_docs.append(Document(page_content=content, metadata=document_metadata))
+                unique_rows.append(i)
+                unique_hashes.append(content_hashes[i])
+        
+        if not unique_docs:
+            return 0, skipped_docs, {"upserted_documents": 0, "errors": []}
+        
+        # Upsert unique documents
+        result = await self.upsert_service.upsert_documents(
+            collection_name, unique_docs, embeddings[unique_rows], unique_hashes
+        )
+        return len(unique_docs), skipped_docs, result
+    
     async def delete_by_source(self, collection_name: str, source: str, 
                               version: Optional[str] = None) -> Dict[str, Any]:
         """Delete all documents from a specific source"""
@@ -124,17 +226,17 @@ class IndexManager:
                     "message": "No documents found for source"
                 }
             
-            # Delete from vector store
-            deleted_count = await self._delete_documents_from_vector_store(
-                collection_name, documents_to_delete
+            # Delete from vector store while hashing the documents off the event loop
+            deleted_count, content_hashes = await asyncio.gather(
+                self._delete_documents_from_vector_store(collection_name, documents_to_delete),
+                asyncio.to_thread(self.dedup_service.compute_content_hashes, documents_to_delete)
             )
             
             # Remove from deduplication tracking
-            for doc in documents_to_delete:
-                self.dedup_service.remove_document(doc)
+            self.dedup_service.remove_hashes(content_hashes)
             
-            # Invalidate cache
-            await self.cache_service.invalidate_collection_cache(collection_name)
+            # Invalidate cache in the background
+            self._run_in_background(self.cache_service.invalidate_collection_cache(collection_name))
             
             logger.info(f"Deleted {deleted_count} documents from source: {source}")
             
@@ -155,13 +257,18 @@ class IndexManager:
     
     async def reindex_document(self, collection_name: str, source: str, 
                               new_documents: List[Dict[str, Any]], 
-                              new_embeddings: List[List[float]]) -> Dict[str, Any]:
+                              new_embeddings: np.ndarray) -> Dict[str, Any]:
         """Atomic delete and reindex of a document"""
         try:
             logger.info(f"Reindexing document: {source} in collection: {collection_name}")
+            new_embeddings = np.asarray(new_embeddings, dtype=np.float32)
             
-            # Step 1: Delete existing documents
-            delete_result = await self.delete_by_source(collection_name, source)
+            # Step 1: Delete existing documents, while the new documents' metadata
+            # and hashes are prepared off the event loop (independent of the delete)
+            delete_result, prepared_chunks = await asyncio.gather(
+                self.delete_by_source(collection_name, source),
+                self._prepare_upsert(new_documents, datetime.utcnow().isoformat())
+            )
             
             if not delete_result["success"]:
                 return {
@@ -171,9 +278,9 @@ class IndexManager:
                     "indexed_documents": 0
                 }
             
-            # Step 2: Index new documents
-            index_result = await self.idempotent_upsert(
-                collection_name, new_documents, new_embeddings
+            # Step 2: Index new documents; dedup lookups run only now, after the delete
+            index_result = await self._commit_upsert(
+                collection_name, new_documents, new_embeddings, prepared_chunks
             )
             
             if not index_result["success"]:
@@ -240,13 +347,6 @@ class IndexManager:
                 "cleaned_documents": 0
             }
     
-    def _compute_content_hash(self, document) -> str:
-        """Compute content hash for deduplication"""
-        content = document.page_content
-        metadata_str = str(sorted(document.metadata.items()))
-        combined = f"{content}|||{metadata_str}"
-        return hashlib.sha256(combined.encode('utf-8')).hexdigest()
-    
     async def _update_collection_metadata(self, collection_name: str, metadata: Dict[str, Any]):
         """Update collection metadata"""
         try:
@@ -371,8 +471,10 @@ class CollectionManager:
             success = await self.index_manager.vector_store.delete_collection(collection_name)
             
             if success:
-                # Invalidate cache
-                await self.index_manager.cache_service.invalidate_collection_cache(collection_name)
+                # Invalidate cache in the background
+                self.index_manager._run_in_background(
+                    self.index_manager.cache_service.invalidate_collection_cache(collection_name)
+                )
                 
                 logger.info(f"Deleted collection: {collection_name}")
                 
@@ -1,9 +1,48 @@
 import logging
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import structlog
 
 logger = structlog.get_logger()
 
+# Static prompt fragments, assembled per request with str.join. Each prompt
+# leads with its static instructions and ends with the per-query parts, so
+# the provider's prefix cache can reuse everything up to the first dynamic byte.
+_USER_PROMPT_PREFIX = (
+    "Please provide a comprehensive answer based on the provided context. "
+    "Remember to cite your sources and acknowledge any limitations in the available information.\n\n"
+)
+_STREAMING_PROMPT_PREFIX = "Answer based on the provided context. Use citations and be concise.\n\n"
+_GUARDRAIL_PROMPT_HEAD = """You are a helpful AI assistant. Answer the following question using ONLY the provided context.
+
+SAFETY RULES:
+- Do not provide harmful, illegal, or unethical information
+- Do not make medical, legal, or financial advice
+- Do not generate content that could be used for malicious purposes
+- If asked about sensitive topics, redirect to appropriate resources
+
+QUALITY RULES:
+- Ground all answers in the provided context
+- Cite sources for all claims
+- Acknowledge limitations and uncertainties
+- Be helpful, harmless, and honest
+
+"""
+
+@lru_cache(maxsize=64)
+def _render_system(base_prompt: str, max_tokens: Optional[str], relax_citations: bool) -> str:
+    """Apply system prompt customizations once per distinct combination"""
+    if max_tokens is not None:
+        base_prompt = base_prompt.replace("{max_tokens}", max_tokens)
+    if relax_citations:
+        base_prompt = base_prompt.replace("MUST cite", "should cite")
+    return base_prompt
+
+@lru_cache(maxsize=64)
+def _static_system_message(system_prompt: str, cacheable_prefix: str) -> str:
+    """System prompt followed by a prompt kind's static instructions"""
+    return "".join((system_prompt, "\n\n", cacheable_prefix.rstrip("\n")))
+
 class PromptTemplates:
     def __init__(self):
         self.system_prompts = {
@@ -17,14 +56,10 @@ class PromptTemplates:
         """Get system prompt by type with optional customization"""
         base_prompt = self.system_prompts.get(prompt_type, self.system_prompts["strict_grounding"])
         
-        # Apply customizations
-        if "max_tokens" in kwargs:
-            base_prompt = base_prompt.replace("{max_tokens}", str(kwargs["max_tokens"]))
-        
-        if "require_citations" in kwargs and not kwargs["require_citations"]:
-            base_prompt = base_prompt.replace("MUST cite", "should cite")
-        
-        return base_prompt
+        # Apply customizations (rendered variants are cached)
+        max_tokens = str(kwargs["max_tokens"]) if "max_tokens" in kwargs else None
+        relax_citations = "require_citations" in kwargs and not kwargs["require_citations"]
+        return _render_system(base_prompt, max_tokens, relax_citations)
     
     def _get_strict_grounding_prompt(self) -> str:
         """Strict grounding prompt that enforces citations and fact verification"""
@@ -114,8 +149,30 @@ RESPONSE STRUCTURE:
 
 Remember: Technical accuracy is paramount. Always cite your sources and provide precise information."""
     
-    def create_user_prompt(self, question: str, context: str, sources: List[Dict[str, Any]]) -> str:
-        """Create user prompt with context and sources"""
+    def build_cacheable_prefix(self, prompt_kind: str = "user") -> str:
+        """Static leading part of a prompt, identical across requests"""
+        prefixes = {
+            "user": _USER_PROMPT_PREFIX,
+            "streaming": _STREAMING_PROMPT_PREFIX,
+            "guardrail": _GUARDRAIL_PROMPT_HEAD
+        }
+        return prefixes.get(prompt_kind, _USER_PROMPT_PREFIX)
+
+    def build_dynamic_suffix(self, question: str, context: str, sources: List[Dict[str, Any]],
+                             prompt_kind: str = "user", max_tokens: int = 4000) -> str:
+        """Query-specific tail of a prompt, everything after build_cacheable_prefix(prompt_kind)"""
+        if prompt_kind == "streaming":
+            # Shorter context for streaming
+            context_preview = context[:2000] + "..." if len(context) > 2000 else context
+            return "".join(("Context: ", context_preview, "\n\nQuestion: ", question))
+
+        if prompt_kind == "guardrail":
+            return "".join((
+                "Context: ", context,
+                "\n\nQuestion: ", question,
+                "\n\nAnswer (max ", str(max_tokens), " tokens):"
+            ))
+
         # Format sources
         source_list = []
         for i, source in enumerate(sources, 1):
@@ -128,26 +185,39 @@ Remember: Technical accuracy is paramount. Always cite your sources and provide
         
         sources_text = "\n".join(source_list)
         
-        return f"""Question: {question}
-
-Context from {len(sources)} sources:
-{context}
+        return "".join((
+            "Available Sources:\n", sources_text,
+            "\n\nContext from ", str(len(sources)), " sources:\n", context,
+            "\n\nQuestion: ", question
+        ))
+
+    def build_messages(self, system_prompt: str, question: str, context: str,
+                       sources: List[Dict[str, Any]], prompt_kind: str = "user",
+                       max_tokens: int = 4000) -> List[Dict[str, str]]:
+        """Chat messages with every static part ahead of the first per-query byte
+
+        The system prompt and the kind's cacheable prefix form one fixed system
+        message, so OpenAI's automatic prefix caching covers both; only the user
+        message changes between requests.
+        """
+        return [
+            {"role": "system", "content": _static_system_message(
+                system_prompt, self.build_cacheable_prefix(prompt_kind)
+            )},
+            {"role": "user", "content": self.build_dynamic_suffix(
+                question, context, sources, prompt_kind, max_tokens
+            )}
+        ]
 
-Available Sources:
-{sources_text}
-
-Please provide a comprehensive answer based on the provided context. Remember to cite your sources and acknowledge any limitations in the available information."""
+    def create_user_prompt(self, question: str, context: str, sources: List[Dict[str, Any]]) -> str:
+        """Create user prompt with context and sources"""
+        return self.build_cacheable_prefix("user") + self.build_dynamic_suffix(question, context, sources)
     
     def create_streaming_prompt(self, question: str, context: str, sources: List[Dict[str, Any]]) -> str:
         """Create prompt optimized for streaming responses"""
-        # Shorter context for streaming
-        context_preview = context[:2000] + "..." if len(context) > 2000 else context
-        
-        return f"""Question: {question}
-
-Context: {context_preview}
-
-Answer based on the provided context. Use citations and be concise."""
+        return self.build_cacheable_prefix("streaming") + self.build_dynamic_suffix(
+            question, context, sources, "streaming"
+        )
     
     def create_evaluation_prompt(self, question: str, answer: str, context: str) -> str:
         """Create prompt for evaluating answer quality"""
@@ -170,25 +240,9 @@ Provide a score from 1-10 for each criterion and overall assessment."""
     
     def get_guardrail_prompt(self, question: str, context: str, max_tokens: int = 4000) -> str:
         """Get prompt with guardrails for safety and quality"""
-        return f"""You are a helpful AI assistant. Answer the following question using ONLY the provided context.
-
-SAFETY RULES:
-- Do not provide harmful, illegal, or unethical information
-- Do not make medical, legal, or financial advice
-- Do not generate content that could be used for malicious purposes
-- If asked about sensitive topics, redirect to appropriate resources
-
-QUALITY RULES:
-- Ground all answers in the provided context
-- Cite sources for all claims
-- Acknowledge limitations and uncertainties
-- Be helpful, harmless, and honest
-
-Question: {question}
-
-Context: {context}
-
-Answer (max {max_tokens} tokens):"""
+        return self.build_cacheable_prefix("guardrail") + self.build_dynamic_suffix(
+            question, context, [], "guardrail", max_tokens
+        )
     
     def get_debug_prompt(self, question: str, context: str, sources: List[Dict[str, Any]], 
                         retrieval_scores: List[float], rerank_scores: List[float]) -> str:
@@ -1,10 +1,33 @@
 import re
 import logging
-from typing import Dict, Any, Tuple
+from collections import defaultdict
+from typing import Dict, Any, List, Pattern, Set, Tuple
+import ahocorasick
 import structlog
 
 logger = structlog.get_logger()
 
+# Keyword classes consulted by the weighting, reranking, expansion and confidence heuristics
+_KEYWORD_CLASSES = {
+    "technical": ['api', 'function', 'method', 'class', 'variable', 'code', 'syntax'],
+    "concept": ['and', 'or', 'but', 'however', 'although', 'while'],
+    "specific": ['specific', 'exact', 'precise', 'detailed', 'particular'],
+    "ambiguous": ['maybe', 'perhaps', 'might', 'could', 'possibly']
+}
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """Build one Aho-Corasick automaton over every keyword class, tagged by class"""
+    automaton = ahocorasick.Automaton()
+    for category, terms in _KEYWORD_CLASSES.items():
+        for term in terms:
+            automaton.add_word(term, (category, term))
+    automaton.make_automaton()
+    return automaton
+
+def _compile_alternation(patterns: List[str]) -> Pattern:
+    """Combine a category's patterns into one regex, one named group per pattern"""
+    return re.compile("|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(patterns)))
+
 class QueryPlanner:
     def __init__(self):
         # Query type patterns
@@ -31,6 +54,14 @@ class QueryPlanner:
             r'\b(list|show|display|present)\b',
             r'\b(available|options|choices|alternatives)\b'
         ]
+        
+        # One precompiled scan per category; queries arrive lowercased
+        self.factual_re = _compile_alternation(self.factual_patterns)
+        self.procedural_re = _compile_alternation(self.procedural_patterns)
+        self.conceptual_re = _compile_alternation(self.conceptual_patterns)
+        self.search_re = _compile_alternation(self.search_patterns)
+        
+        self.keyword_automaton = _build_keyword_automaton()
     
     def analyze_query(self, query: str) -> Dict[str, Any]:
         """Analyze query and return planning information"""
@@ -39,14 +70,17 @@ class QueryPlanner:
         # Determine query type
         query_type = self._classify_query_type(query_lower)
         
+        # Find every keyword class term in one pass over the query
+        hits = self._keyword_hits(query_lower)
+        
         # Calculate weights based on query type
-        bm25_weight, vector_weight = self._calculate_weights(query_type, query_lower)
+        bm25_weight, vector_weight = self._calculate_weights(query_type, query_lower, hits)
         
         # Determine if reranking is beneficial
-        use_reranking = self._should_use_reranking(query_type, query_lower)
+        use_reranking = self._should_use_reranking(query_type, query_lower, hits)
         
         # Determine if query expansion is beneficial
-        use_expansion = self._should_use_expansion(query_type, query_lower)
+        use_expansion = self._should_use_expansion(query_type, query_lower, hits)
         
         return {
             "query_type": query_type,
@@ -54,30 +88,33 @@ class QueryPlanner:
             "vector_weight": vector_weight,
             "use_reranking": use_reranking,
             "use_expansion": use_expansion,
-            "confidence": self._calculate_confidence(query_type, query_lower)
+            "confidence": self._calculate_confidence(query_type, query_lower, hits)
         }
     
     def _classify_query_type(self, query: str) -> str:
         """Classify the type of query"""
         scores = {
-            "factual": self._score_patterns(query, self.factual_patterns),
-            "procedural": self._score_patterns(query, self.procedural_patterns),
-            "conceptual": self._score_patterns(query, self.conceptual_patterns),
-            "search": self._score_patterns(query, self.search_patterns)
+            "factual": self._score_re(query, self.factual_re),
+            "procedural": self._score_re(query, self.procedural_re),
+            "conceptual": self._score_re(query, self.conceptual_re),
+            "search": self._score_re(query, self.search_re)
         }
         
         # Return the type with highest score, default to factual
         return max(scores, key=scores.get) if max(scores.values()) > 0 else "factual"
     
-    def _score_patterns(self, query: str, patterns: list) -> int:
-        """Score query against pattern list"""
-        score = 0
-        for pattern in patterns:
-            if re.search(pattern, query, re.IGNORECASE):
-                score += 1
-        return score
+    def _score_re(self, query: str, compiled: Pattern) -> int:
+        """Score query by how many of the category's patterns match"""
+        return len({match.lastgroup for match in compiled.finditer(query)})
+    
+    def _keyword_hits(self, query: str) -> Dict[str, Set[str]]:
+        """Distinct keyword terms found in the query (substring matches), by class"""
+        hits = defaultdict(set)
+        for _, (category, term) in self.keyword_automaton.iter(query):
+            hits[category].add(term)
+        return hits
     
-    def _calculate_weights(self, query_type: str, query: str) -> Tuple[float, float]:
+    def _calculate_weights(self, query_type: str, query: str, hits: Dict[str, Set[str]]) -> Tuple[float, float]:
         """Calculate BM25 and vector weights based on query type"""
         base_weights = {
             "factual": (0.4, 0.6),      # More semantic for facts
@@ -100,8 +137,7 @@ class QueryPlanner:
             vector_base -= 0.1
         
         # Technical terms suggest more keyword search
-        technical_terms = ['api', 'function', 'method', 'class', 'variable', 'code', 'syntax']
-        if any(term in query for term in technical_terms):
+        if hits["technical"]:
             bm25_base += 0.1
             vector_base -= 0.1
         
@@ -109,7 +145,7 @@ class QueryPlanner:
         total = bm25_base + vector_base
         return bm25_base / total, vector_base / total
     
-    def _should_use_reranking(self, query_type: str, query: str) -> bool:
+    def _should_use_reranking(self, query_type: str, query: str, hits: Dict[str, Set[str]]) -> bool:
         """Determine if reranking should be used"""
         # Always use reranking for complex queries
         if len(query.split()) > 8:
@@ -120,13 +156,12 @@ class QueryPlanner:
             return True
         
         # Use reranking if query has multiple concepts
-        concept_indicators = ['and', 'or', 'but', 'however', 'although', 'while']
-        if sum(1 for indicator in concept_indicators if indicator in query) > 1:
+        if len(hits["concept"]) > 1:
             return True
         
         return False
     
-    def _should_use_expansion(self, query_type: str, query: str) -> bool:
+    def _should_use_expansion(self, query_type: str, query: str, hits: Dict[str, Set[str]]) -> bool:
         """Determine if query expansion should be used"""
         # Use expansion for short queries
         if len(query.split()) < 4:
@@ -137,13 +172,12 @@ class QueryPlanner:
             return True
         
         # Use expansion if query lacks specificity
-        specific_terms = ['specific', 'exact', 'precise', 'detailed', 'particular']
-        if not any(term in query for term in specific_terms):
+        if not hits["specific"]:
             return True
         
         return False
     
-    def _calculate_confidence(self, query_type: str, query: str) -> float:
+    def _calculate_confidence(self, query_type: str, query: str, hits: Dict[str, Set[str]]) -> float:
         """Calculate confidence in the query analysis"""
         # Base confidence
         confidence = 0.7
@@ -160,8 +194,7 @@ class QueryPlanner:
             confidence += 0.1
         
         # Decrease confidence for ambiguous queries
-        ambiguous_terms = ['maybe', 'perhaps', 'might', 'could', 'possibly']
-        if any(term in query for term in ambiguous_terms):
+        if hits["ambiguous"]:
             confidence -= 0.2
         
         return min(1.0, max(0.0, confidence))
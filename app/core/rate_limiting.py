@@ -1,14 +1,70 @@
 import asyncio
+import heapq
 import time
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set, Tuple
+import numpy as np
 import structlog
-from collections import defaultdict, deque
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 logger = structlog.get_logger()
 
+def _now() -> float:
+    """Clock shared by every rate-limit timestamp (monotonic, seconds)"""
+    return time.monotonic()
+
+# Initial per-key timestamp capacity; logs double when they fill up
+_REQUEST_LOG_CAPACITY = 64
+
+class RequestLog:
+    """Per-key request timestamps in a float64 buffer; live entries are ts[head:end]
+    
+    Timestamps are appended in increasing order, so the live slice stays sorted
+    and window counts and evictions are binary searches instead of scans.
+    """
+    __slots__ = ("ts", "head", "end")
+    
+    def __init__(self, capacity: int = _REQUEST_LOG_CAPACITY):
+        self.ts = np.empty(capacity, dtype=np.float64)
+        self.head = 0
+        self.end = 0
+    
+    def __len__(self) -> int:
+        return self.end - self.head
+    
+    def live(self) -> np.ndarray:
+        """View of the timestamps still being tracked"""
+        return self.ts[self.head:self.end]
+    
+    def append(self, timestamp: float):
+        """Record a timestamp, compacting or growing the buffer when it is full"""
+        if self.end == len(self.ts):
+            live = self.live()
+            if len(live) * 2 > len(self.ts):
+                grown = np.empty(len(self.ts) * 2, dtype=np.float64)
+                grown[:len(live)] = live
+                self.ts = grown
+            else:
+                self.ts[:len(live)] = live
+            self.head, self.end = 0, len(live)
+        self.ts[self.end] = timestamp
+        self.end += 1
+    
+    def evict_before(self, cutoff: float):
+        """Drop timestamps older than cutoff"""
+        self.head += int(np.searchsorted(self.live(), cutoff, side="left"))
+    
+    def counts_after(self, cutoffs: Tuple[float, ...]) -> List[Tuple[int, float]]:
+        """For each cutoff, the number of timestamps newer than it and the oldest of them"""
+        live = self.live()
+        indices = np.searchsorted(live, cutoffs, side="right").tolist()
+        return [(len(live) - i, float(live[i]) if i < len(live) else 0.0) for i in indices]
+
+# Stand-in for keys with no recorded requests, so checks don't create tracking entries
+_EMPTY_REQUEST_LOG = RequestLog(0)
+
 @dataclass
 class RateLimitConfig:
     requests_per_minute: int = 100
@@ -27,34 +83,51 @@ class APIKeyQuota:
     scopes: list  # ['ingest', 'query', 'admin']
     is_active: bool = True
     created_at: datetime = None
-    last_used: datetime = None
+    last_used: Optional[float] = None  # monotonic seconds, see _now()
 
 class RateLimiter:
+    # State is only touched from the event loop, and no read-modify-write below
+    # spans an await, so each check/record/release is atomic without locks.
+    # Keep it that way: do not call into these methods from executor threads.
     def __init__(self, default_config: RateLimitConfig = None):
         self.default_config = default_config or RateLimitConfig()
         self.api_key_quotas: Dict[str, APIKeyQuota] = {}
-        self.request_tracking: Dict[str, deque] = defaultdict(deque)
+        self.request_tracking: Dict[str, RequestLog] = defaultdict(RequestLog)
+        # (oldest tracked timestamp, api_key) per tracked key, so cleanup only visits
+        # keys that may have expired entries; the timestamp is a lower bound
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._expiry_keys: Set[str] = set()
         self.concurrent_requests: Dict[str, int] = defaultdict(int)
+        # Running sums of concurrent_requests and of every quota's concurrency cap
+        self._total_concurrent = 0
+        self._total_capacity = 0
         self.queue_depths: Dict[str, int] = defaultdict(int)
         self.cleanup_interval = 300  # 5 minutes
-        self.last_cleanup = time.time()
+        self.last_cleanup = _now()
     
     def add_api_key_quota(self, quota: APIKeyQuota):
         """Add or update API key quota"""
+        previous = self.api_key_quotas.get(quota.api_key)
+        if previous is not None:
+            self._total_capacity -= previous.concurrent_requests
+        self._total_capacity += quota.concurrent_requests
         self.api_key_quotas[quota.api_key] = quota
         logger.info(f"Added quota for API key: {quota.api_key[:8]}...")
     
     def remove_api_key_quota(self, api_key: str):
         """Remove API key quota"""
         if api_key in self.api_key_quotas:
-            del self.api_key_quotas[api_key]
+            self._total_capacity -= self.api_key_quotas.pop(api_key).concurrent_requests
             logger.info(f"Removed quota for API key: {api_key[:8]}...")
     
-    async def check_rate_limit(self, api_key: str, request_type: str = "query") -> Dict[str, Any]:
+    async def check_rate_limit(self, api_key: str, request_type: str = "query",
+                               now: Optional[float] = None) -> Dict[str, Any]:
         """Check if request is within rate limits"""
         try:
+            current_time = _now() if now is None else now
+            
             # Cleanup old tracking data
-            await self._cleanup_old_data()
+            await self._cleanup_old_data(current_time)
             
             # Get quota for API key
             quota = self.api_key_quotas.get(api_key)
@@ -77,8 +150,6 @@ class RateLimiter:
                     burst_limit=quota.burst_limit
                 )
             
-            current_time = time.time()
-            
             # Check concurrent requests
             if self.concurrent_requests[api_key] >= config.concurrent_requests:
                 return {
@@ -89,16 +160,11 @@ class RateLimiter:
                     "max_concurrent": config.concurrent_requests
                 }
             
-            # Check rate limits
+            # Check rate and burst limits
             rate_check = self._check_rate_limits(api_key, config, current_time)
             if not rate_check["allowed"]:
                 return rate_check
             
-            # Check burst limit
-            burst_check = self._check_burst_limit(api_key, config, current_time)
-            if not burst_check["allowed"]:
-                return burst_check
-            
             # All checks passed
             return {
                 "allowed": True,
@@ -118,74 +184,66 @@ class RateLimiter:
             }
     
     def _check_rate_limits(self, api_key: str, config: RateLimitConfig, current_time: float) -> Dict[str, Any]:
-        """Check minute and hour rate limits"""
-        requests = self.request_tracking[api_key]
+        """Check minute, hour and burst (last 10 seconds) limits"""
+        requests = self.request_tracking.get(api_key, _EMPTY_REQUEST_LOG)
         
         # Remove old requests outside the window
-        cutoff_time = current_time - config.window_size
-        while requests and requests[0] < cutoff_time:
-            requests.popleft()
+        requests.evict_before(current_time - config.window_size)
         
-        # Check minute limit
-        minute_cutoff = current_time - 60
-        minute_requests = [req_time for req_time in requests if req_time > minute_cutoff]
+        # Count all three windows with one vectorized binary search
+        (minute_count, minute_oldest), (hour_count, hour_oldest), (burst_count, burst_oldest) = (
+            requests.counts_after((current_time - 60, current_time - 3600, current_time - 10))
+        )
         
-        if len(minute_requests) >= config.requests_per_minute:
+        # Check minute limit
+        if minute_count >= config.requests_per_minute:
             return {
                 "allowed": False,
                 "reason": "Rate limit exceeded (per minute)",
-                "retry_after": 60 - (current_time - minute_requests[0]),
-                "current_requests": len(minute_requests),
+                "retry_after": 60 - (current_time - minute_oldest),
+                "current_requests": minute_count,
                 "max_requests": config.requests_per_minute
             }
         
         # Check hour limit
-        hour_cutoff = current_time - 3600
-        hour_requests = [req_time for req_time in requests if req_time > hour_cutoff]
-        
-        if len(hour_requests) >= config.requests_per_hour:
+        if hour_count >= config.requests_per_hour:
             return {
                 "allowed": False,
                 "reason": "Rate limit exceeded (per hour)",
-                "retry_after": 3600 - (current_time - hour_requests[0]),
-                "current_requests": len(hour_requests),
+                "retry_after": 3600 - (current_time - hour_oldest),
+                "current_requests": hour_count,
                 "max_requests": config.requests_per_hour
             }
         
-        return {"allowed": True}
-    
-    def _check_burst_limit(self, api_key: str, config: RateLimitConfig, current_time: float) -> Dict[str, Any]:
-        """Check burst limit (requests in short time window)"""
-        requests = self.request_tracking[api_key]
-        
-        # Check last 10 seconds for burst
-        burst_cutoff = current_time - 10
-        burst_requests = [req_time for req_time in requests if req_time > burst_cutoff]
-        
-        if len(burst_requests) >= config.burst_limit:
+        # Check burst limit
+        if burst_count >= config.burst_limit:
             return {
                 "allowed": False,
                 "reason": "Burst limit exceeded",
-                "retry_after": 10 - (current_time - burst_requests[0]),
-                "current_burst": len(burst_requests),
+                "retry_after": 10 - (current_time - burst_oldest),
+                "current_burst": burst_count,
                 "max_burst": config.burst_limit
             }
         
         return {"allowed": True}
     
-    async def record_request(self, api_key: str, request_type: str = "query"):
+    async def record_request(self, api_key: str, request_type: str = "query", now: Optional[float] = None):
         """Record a request for rate limiting"""
-        current_time = time.time()
+        current_time = _now() if now is None else now
         
         # Add to request tracking
         self.request_tracking[api_key].append(current_time)
+        if api_key not in self._expiry_keys:
+            self._expiry_keys.add(api_key)
+            heapq.heappush(self._expiry_heap, (current_time, api_key))
         
         # Increment concurrent requests
         self.concurrent_requests[api_key] += 1
+        self._total_concurrent += 1
         
         # Update last used time
         if api_key in self.api_key_quotas:
-            self.api_key_quotas[api_key].last_used = datetime.now()
+            self.api_key_quotas[api_key].last_used = current_time
         
         logger.debug(f"Recorded request for API key: {api_key[:8]}...")
     
@@ -193,28 +251,32 @@ class RateLimiter:
         """Release a request (decrement concurrent count)"""
         if self.concurrent_requests[api_key] > 0:
             self.concurrent_requests[api_key] -= 1
+            self._total_concurrent -= 1
             logger.debug(f"Released request for API key: {api_key[:8]}...")
     
-    async def _cleanup_old_data(self):
+    async def _cleanup_old_data(self, current_time: float):
         """Cleanup old tracking data"""
-        current_time = time.time()
-        
         # Only cleanup every 5 minutes
         if current_time - self.last_cleanup < self.cleanup_interval:
             return
         
         self.last_cleanup = current_time
         
-        # Remove old requests (older than 1 hour)
+        # Remove old requests (older than 1 hour), visiting only keys whose
+        # oldest tracked request may be past the cutoff
         cutoff_time = current_time - 3600
-        for api_key in list(self.request_tracking.keys()):
+        heap = self._expiry_heap
+        while heap and heap[0][0] < cutoff_time:
+            _, api_key = heapq.heappop(heap)
             requests = self.request_tracking[api_key]
-            while requests and requests[0] < cutoff_time:
-                requests.popleft()
+            requests.evict_before(cutoff_time)
             
-            # Remove empty tracking
-            if not requests:
+            if requests:
+                heapq.heappush(heap, (float(requests.live()[0]), api_key))
+            else:
+                # Remove empty tracking
                 del self.request_tracking[api_key]
+                self._expiry_keys.discard(api_key)
         
         logger.debug("Cleaned up old rate limit data")
     
@@ -226,9 +288,13 @@ class RateLimiter:
         """Set queue depth for API key"""
         self.queue_depths[api_key] = depth
     
+    def get_totals(self) -> Tuple[int, int]:
+        """Total concurrent requests and total concurrency capacity across API keys"""
+        return self._total_concurrent, self._total_capacity
+    
     def get_metrics(self) -> Dict[str, Any]:
         """Get rate limiting metrics"""
-        total_concurrent = sum(self.concurrent_requests.values())
+        total_concurrent = self._total_concurrent
         total_queue_depth = sum(self.queue_depths.values())
         
         api_key_stats = {}
@@ -257,11 +323,11 @@ class BackpressureController:
         self.max_queue_depth = 100
         self.overload_threshold = 0.8
     
-    async def should_accept_request(self, api_key: str) -> Dict[str, Any]:
+    async def should_accept_request(self, api_key: str, now: Optional[float] = None) -> Dict[str, Any]:
         """Check if request should be accepted based on backpressure"""
         try:
             # Check rate limits first
-            rate_check = await self.rate_limiter.check_rate_limit(api_key)
+            rate_check = await self.rate_limiter.check_rate_limit(api_key, now=now)
             if not rate_check["allowed"]:
                 return rate_check
             
@@ -277,8 +343,7 @@ class BackpressureController:
                 }
             
             # Check system overload
-            total_concurrent = sum(self.rate_limiter.concurrent_requests.values())
-            total_capacity = sum(q.concurrent_requests for q in self.rate_limiter.api_key_quotas.values())
+            total_concurrent, total_capacity = self.rate_limiter.get_totals()
             
             if total_capacity > 0:
                 load_ratio = total_concurrent / total_capacity
@@ -315,7 +380,7 @@ class BackpressureController:
         total_queue_depth = metrics["total_queue_depth"]
         
         # Calculate load ratio
-        total_capacity = sum(q.concurrent_requests for q in self.rate_limiter.api_key_quotas.values())
+        _, total_capacity = self.rate_limiter.get_totals()
         load_ratio = total_concurrent / total_capacity if total_capacity > 0 else 0
         
         health_status = "healthy"
@@ -333,3 +398,28 @@ class BackpressureController:
             "overload_threshold": self.overload_threshold,
             "metrics": metrics
         }
+
+class TokenBucket:
+    """Async token bucket for pacing outbound calls against a per-minute budget"""
+    
+    def __init__(self, tokens_per_minute: float, capacity: Optional[float] = None):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = capacity or tokens_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, amount: float = 1.0):
+        """Wait until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                
+                await asyncio.sleep((amount - self.tokens) / self.rate)
@@ -0,0 +1,33 @@
+import redis.asyncio as redis
+import structlog
+
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+# One connection pool per process, shared by every async Redis consumer
+# (cache service, health checks). Connections are opened lazily.
+redis_pool = redis.ConnectionPool.from_url(
+    settings.redis_url,
+    max_connections=settings.redis_max_connections
+)
+
+def get_redis_client() -> redis.Redis:
+    """Get a Redis client backed by the shared connection pool"""
+    return redis.Redis(connection_pool=redis_pool)
+
+def open_dedicated_client(**kwargs) -> redis.Redis:
+    """Get a Redis client with its own private connections, never the shared pool
+
+    For connections put into a special mode (SUBSCRIBE, CLIENT TRACKING) that must
+    not be handed to other consumers; close with aclose(close_connection_pool=True).
+    """
+    return redis.Redis.from_url(settings.redis_url, **kwargs)
+
+async def close_redis_pool():
+    """Close all connections in the shared pool"""
+    try:
+        await redis_pool.disconnect()
+        logger.info("Redis connection pool closed")
+    except Exception as e:
+        logger.warning(f"Error closing Redis connection pool: {e}")
@@ -1,11 +1,10 @@
 import asyncio
 import logging
 from typing import List, Dict, Any, Optional, Tuple
-import hashlib
-import json
 import time
 from functools import lru_cache
 import structlog
+import xxhash
 from sentence_transformers import CrossEncoder
 import cohere
 
@@ -46,10 +45,9 @@ class RerankingService:
             logger.error(f"Failed to initialize reranker: {e}")
             self.reranker = None
     
-    def _get_cache_key(self, query: str, documents: List[str]) -> str:
-        """Generate cache key for reranking results"""
-        content = f"{query}|||{json.dumps(documents, sort_keys=True)}"
-        return hashlib.md5(content.encode()).hexdigest()
+    def _get_doc_key(self, document: str) -> bytes:
+        """Generate per-document cache key (raw digest) for reranking scores"""
+        return xxhash.xxh3_128_digest(document.encode())
     
     async def score_batch(self, query: str, documents: List[Tuple[Any, float]]) -> List[float]:
         """Score a batch of documents for reranking"""
@@ -58,25 +56,32 @@ class RerankingService:
         
         try:
             # Extract document texts
-            doc_texts = [doc.page_content if hasattr(doc, 'page_content') else str(doc) 
+            doc_texts = [doc.page_content if hasattr(doc, 'page_content') else str(doc)
                         for doc, _ in documents]
             
-            # Check cache first
-            cache_key = self._get_cache_key(query, doc_texts)
-            cached_scores = await self.cache_service.get_rerank_score(cache_key, "batch")
+            # Check cache first (single round-trip for the whole batch)
+            doc_keys = [self._get_doc_key(text) for text in doc_texts]
+            scores = await self.cache_service.get_rerank_scores(query, doc_keys)
             
-            if cached_scores is not None:
+            missing = [i for i, score in enumerate(scores) if score is None]
+            if not missing:
                 logger.debug("Using cached reranking scores")
-                return cached_scores
+                return scores
             
-            # Perform reranking
+            # Perform reranking only for documents without a cached score
+            missing_texts = [doc_texts[i] for i in missing]
             if self.reranker_type == 'cohere' and self.cohere_client:
-                scores = await self._rerank_with_cohere(query, doc_texts)
+                new_scores = await self._rerank_with_cohere(query, missing_texts)
             else:
-                scores = await self._rerank_with_cross_encoder(query, doc_texts)
+                new_scores = await self._rerank_with_cross_encoder(query, missing_texts)
+            
+            for i, score in zip(missing, new_scores):
+                scores[i] = score
             
             # Cache results
-            await self.cache_service.set_rerank_score(cache_key, "batch", scores, self.cache_ttl)
+            await self.cache_service.set_rerank_scores(
+                query, [doc_keys[i] for i in missing], new_scores, self.cache_ttl
+            )
             
             return scores
             
@@ -12,6 +12,8 @@ from pathlib import Path
 import magic
 import hashlib
 
+from app.core.config import settings
+
 logger = structlog.get_logger()
 
 # Rate limiter
@@ -19,12 +21,16 @@ limiter = Limiter(key_func=get_remote_address)
 
 class SecurityService:
     def __init__(self):
-        self.allowed_file_types = {
+        mime_types = {
             '.pdf': 'application/pdf',
             '.txt': 'text/plain',
             '.md': 'text/markdown',
             '.markdown': 'text/markdown'
         }
+        self.allowed_file_types = {
+            ext: mime for ext, mime in mime_types.items()
+            if ext[1:] in settings.allowed_file_types_tuple
+        }
         self.max_file_size = 100 * 1024 * 1024  # 100MB
         self.temp_dir = None
         self._setup_temp_directory()
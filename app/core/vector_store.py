@@ -1,6 +1,7 @@
 import os
 import logging
 from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 import pinecone
@@ -76,6 +77,9 @@ class VectorStoreManager:
     async def add_documents(self, collection_name: str, documents: List[Document], embeddings: List[List[float]]) -> bool:
         """Add documents to vector store"""
         try:
+            # Embeddings may be held as compact float16 arrays; stores take float32 lists
+            embeddings = [np.asarray(embedding, dtype=np.float32).tolist() for embedding in embeddings]
+            
             if self.provider == "pinecone":
                 return await self._add_to_pinecone(collection_name, documents, embeddings)
             else:
@@ -2,6 +2,7 @@ import re
 import logging
 from typing import List, Dict, Any, Tuple, Optional
 from pathlib import Path
+from functools import lru_cache
 import structlog
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownTextSplitter
 from langchain.schema import Document
@@ -9,23 +10,28 @@ import hashlib
 
 logger = structlog.get_logger()
 
+@lru_cache(maxsize=32)
+def _get_splitters(chunk_size: int, chunk_overlap: int) -> Tuple[RecursiveCharacterTextSplitter, MarkdownTextSplitter]:
+    """Shared text/markdown splitters per size/overlap (splitters hold no per-call state)"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    markdown_splitter = MarkdownTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return text_splitter, markdown_splitter
+
 class SectionAwareChunker:
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         
         # Initialize splitters
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        self.markdown_splitter = MarkdownTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
+        self.text_splitter, self.markdown_splitter = _get_splitters(chunk_size, chunk_overlap)
         
         # Section patterns
         self.heading_patterns = [
@@ -14,7 +14,8 @@ from app.core.config import settings
 from app.core.security import SecurityService, RequestValidator, AuditLogger
 from app.core.rate_limiting import RateLimiter, BackpressureController, APIKeyQuota
 from app.core.cache import CacheService, CacheMetrics
-from app.utils.monitoring import start_monitoring
+from app.core.redis_pool import close_redis_pool
+from app.utils.monitoring import start_monitoring, flush_pending_counters
 
 logger = structlog.get_logger()
 
@@ -72,7 +73,8 @@ rate_limiter.add_api_key_quota(default_quota)
 # Request logging and security middleware
 @app.middleware("http")
 async def security_and_logging_middleware(request: Request, call_next):
-    start_time = time.time()
+    # One clock read per request, shared by rate limiting and the latency log
+    start_time = time.monotonic()
     
     # Get API key from request
     api_key = request.headers.get("x-api-key", "default")
@@ -81,7 +83,7 @@ async def security_and_logging_middleware(request: Request, call_next):
     audit_logger.log_request(request, api_key)
     
     # Check backpressure
-    backpressure_check = await backpressure_controller.should_accept_request(api_key)
+    backpressure_check = await backpressure_controller.should_accept_request(api_key, now=start_time)
     if not backpressure_check["allowed"]:
         logger.warning(f"Request rejected due to backpressure: {backpressure_check['reason']}")
         return JSONResponse(
@@ -95,7 +97,7 @@ async def security_and_logging_middleware(request: Request, call_next):
         )
     
     # Record request
-    await rate_limiter.record_request(api_key)
+    await rate_limiter.record_request(api_key, now=start_time)
     
     # Validate request size
     if not request_validator.validate_request_size(request):
@@ -110,7 +112,7 @@ async def security_and_logging_middleware(request: Request, call_next):
         response = await call_next(request)
         
         # Log response
-        process_time = time.time() - start_time
+        process_time = time.monotonic() - start_time
         logger.info(
             "Request completed",
             method=request.method,
@@ -260,9 +262,12 @@ async def shutdown_event():
     # Cleanup security service
     security_service.cleanup_temp_directory()
     
-    # Close cache connections
-    if cache_service.redis_client:
-        await cache_service.redis_client.close()
+    # Apply batched metric increments before exit
+    flush_pending_counters()
+
+    # Flush pending cache writes and close cache connections
+    await cache_service.close()
+    await close_redis_pool()
 
 if __name__ == "__main__":
     import uvicorn
@@ -270,6 +275,7 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=8000,
+        loop="uvloop",
         reload=True,
         log_level=settings.log_level.lower()
     )
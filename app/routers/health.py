@@ -8,6 +8,7 @@ from datetime import datetime
 from app.core.config import settings
 from app.core.vector_store import VectorStoreManager
 from app.core.embedding_service import EmbeddingService
+from app.core.redis_pool import get_redis_client
 from app.utils.auth import verify_api_key
 
 logger = structlog.get_logger()
@@ -161,9 +162,8 @@ async def check_embedding_service() -> Dict[str, Any]:
 async def check_redis() -> Dict[str, Any]:
     """Check Redis health"""
     try:
-        import redis
-        redis_client = redis.from_url(settings.redis_url)
-        redis_client.ping()
+        redis_client = get_redis_client()
+        await redis_client.ping()
         return {
             "healthy": True,
             "url": settings.redis_url,
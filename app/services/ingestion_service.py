@@ -100,8 +100,9 @@ class IngestionService:
             # Chunk document
             chunks = chunk_document(cleaned_doc, chunk_size, chunk_overlap)
             
-            # Generate embeddings
-            embeddings = await self.embedding_service.embed_documents_batch(chunks)
+            # Generate unit-normalized embeddings (kept out of the stored metadata)
+            chunks = await self.embedding_service.embed_documents_async(chunks)
+            embeddings = [chunk.metadata.pop("embedding") for chunk in chunks]
             
             return {
                 "documents": chunks,
@@ -135,10 +135,15 @@ class MassiveIngestionService:
         start_time = time.time()
         
         try:
-            # Process documents
-            documents = await self.document_processor.process_files(batch_paths, len(batch_paths))
+            # Parse, chunk and embed as overlapping pipeline stages
+            embedded_documents = await self.document_processor.process_and_embed(
+                batch_paths,
+                self.embedding_service.embed_documents_async,
+                embed_batch_size=self.embedding_service.batch_size,
+                embed_concurrency=self.embedding_service.concurrency
+            )
             
-            if not documents:
+            if not embedded_documents:
                 return {
                     "documents_processed": 0,
                     "chunks_created": 0,
@@ -146,11 +151,8 @@ class MassiveIngestionService:
                     "errors": ["No documents processed in batch"]
                 }
             
-            # Generate embeddings in parallel
-            embedded_documents = await self.embedding_service.embed_documents_async(documents)
-            
-            # Extract embeddings
-            embeddings = [doc.metadata.get("embedding") for doc in embedded_documents]
+            # Extract embeddings (kept out of the stored metadata)
+            embeddings = [doc.metadata.pop("embedding") for doc in embedded_documents]
             
             # Store in vector database
             success = await self.vector_store.add_documents(
@@ -20,6 +20,8 @@ from app.utils.monitoring import (
 
 logger = structlog.get_logger()
 
+_STREAMING_SYSTEM_PROMPT = "You are a helpful assistant. Provide accurate, cited responses."
+
 class QueryService:
     def __init__(self):
         self.embedding_service = EmbeddingService()
@@ -143,19 +145,12 @@ class QueryService:
                                collection_name: str, top_k: int, plan: Dict[str, Any]) -> List[Tuple[Any, float]]:
         """Perform hybrid retrieval with BM25 and vector search"""
         try:
-            # Get vector results
-            vector_results = await self.vector_store.similarity_search(
-                collection_name, query_embedding, top_k * 2
-            )
-            
-            # Get BM25 results
-            bm25_results = await self.hybrid_search.bm25_search(
-                collection_name, question, top_k * 2
-            )
-            
-            # Blend results
-            blended_results = await self.hybrid_search.blend(
-                question, vector_results, bm25_results, top_k,
+            # Vector and BM25 searches run concurrently, then get blended
+            blended_results = await self.hybrid_search.hybrid_search_full(
+                collection_name, question,
+                self.vector_store.similarity_search(collection_name, query_embedding, top_k * 2),
+                top_k,
+                candidate_k=top_k * 2,
                 semantic_weight=plan.get("vector_weight", 0.7),
                 keyword_weight=plan.get("bm25_weight", 0.3)
             )
@@ -203,17 +198,15 @@ class QueryService:
                 require_citations=True
             )
             
-            user_prompt = self.prompt_templates.create_user_prompt(
-                question, context, sources
+            # Static instructions lead, so repeated requests share a cached prefix
+            messages = self.prompt_templates.build_messages(
+                system_prompt, question, context, sources
             )
             
             # Generate answer
             response = await self.openai_client.chat.completions.create(
                 model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 max_tokens=settings.max_tokens,
                 temperature=0.1,
                 top_p=0.9
@@ -282,28 +275,25 @@ class QueryService:
             
             context = "\n\n".join(context_parts)
             
-            # Create streaming prompt
-            user_prompt = self.prompt_templates.create_streaming_prompt(
-                question, context, []
+            # Create streaming messages
+            messages = self.prompt_templates.build_messages(
+                _STREAMING_SYSTEM_PROMPT, question, context, [], "streaming"
             )
             
             # Stream response
-            async for chunk in self._stream_generation(user_prompt):
+            async for chunk in self._stream_generation(messages):
                 yield chunk
                 
         except Exception as e:
             logger.error(f"Streaming query failed: {e}")
             yield f"Error: {str(e)}"
     
-    async def _stream_generation(self, user_prompt: str) -> AsyncGenerator[str, None]:
+    async def _stream_generation(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
         """Stream generation from OpenAI"""
         try:
             response = await self.openai_client.chat.completions.create(
                 model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant. Provide accurate, cited responses."},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 max_tokens=settings.max_tokens,
                 temperature=0.1,
                 stream=True
@@ -1,9 +1,11 @@
+import asyncio
 import time
 import logging
-from typing import Dict, Any
+from collections import defaultdict
+from typing import Dict, Any, Optional, Tuple
 import structlog
 from prometheus_client import Counter, Histogram, Gauge, start_http_server, CollectorRegistry
-from functools import wraps
+from functools import lru_cache, partial, wraps
 
 logger = structlog.get_logger()
 
@@ -153,6 +155,47 @@ STAGE_DURATION = Histogram(
     registry=registry
 )
 
+# Upper bound on cached label children across all metrics
+_LABEL_CHILD_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=_LABEL_CHILD_CACHE_SIZE)
+def _child(metric, *label_values):
+    """Labelled child of a metric, resolved once per label combination"""
+    return metric.labels(*label_values)
+
+# Counter increments made on the event loop are summed here and applied by a
+# background flusher, so a burst of requests costs one metric lock per label set
+_COUNTER_FLUSH_INTERVAL = 0.1
+_pending_counts: Dict[Tuple[Any, Tuple], float] = defaultdict(float)
+_counter_flusher: Optional[asyncio.Task] = None
+
+def _inc(metric, *label_values, amount: float = 1.0):
+    """Increment a labelled counter, batched when called from the event loop"""
+    global _counter_flusher
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Worker threads and sync code update the counter directly
+        _child(metric, *label_values).inc(amount)
+        return
+
+    _pending_counts[(metric, label_values)] += amount
+    if _counter_flusher is None or _counter_flusher.done():
+        _counter_flusher = loop.create_task(_flush_counters_periodically())
+
+async def _flush_counters_periodically():
+    """Apply pending counter increments every flush interval until idle"""
+    while _pending_counts:
+        await asyncio.sleep(_COUNTER_FLUSH_INTERVAL)
+        flush_pending_counters()
+
+def flush_pending_counters():
+    """Apply all pending counter increments now"""
+    global _pending_counts
+    pending, _pending_counts = _pending_counts, defaultdict(float)
+    for (metric, label_values), amount in pending.items():
+        _child(metric, *label_values).inc(amount)
+
 def start_monitoring(port: int = 8001):
     """Start Prometheus metrics server"""
     try:
@@ -164,53 +207,53 @@ def start_monitoring(port: int = 8001):
 
 def record_request_metrics(method: str, endpoint: str, status_code: int, duration: float):
     """Record request metrics"""
-    REQUEST_COUNT.labels(method=method, endpoint=endpoint, status_code=status_code).inc()
-    REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
+    _inc(REQUEST_COUNT, method, endpoint, status_code)
+    _child(REQUEST_DURATION, method, endpoint).observe(duration)
 
 def record_ingestion_metrics(collection: str, file_type: str, doc_count: int, 
                            chunk_count: int, duration: float):
     """Record ingestion metrics"""
-    INGESTION_DOCUMENTS.labels(collection=collection, file_type=file_type).inc(doc_count)
-    INGESTION_CHUNKS.labels(collection=collection).inc(chunk_count)
-    INGESTION_DURATION.labels(collection=collection).observe(duration)
+    _inc(INGESTION_DOCUMENTS, collection, file_type, amount=doc_count)
+    _inc(INGESTION_CHUNKS, collection, amount=chunk_count)
+    _child(INGESTION_DURATION, collection).observe(duration)
 
 def record_query_metrics(collection: str, search_type: str, result_count: int, duration: float):
     """Record query metrics"""
-    QUERY_DURATION.labels(collection=collection, search_type=search_type).observe(duration)
-    QUERY_RESULTS.labels(collection=collection).observe(result_count)
+    _child(QUERY_DURATION, collection, search_type).observe(duration)
+    _child(QUERY_RESULTS, collection).observe(result_count)
 
 def record_embedding_metrics(model: str, token_count: int, duration: float):
     """Record embedding metrics"""
-    EMBEDDING_DURATION.labels(model=model).observe(duration)
-    EMBEDDING_TOKENS.labels(model=model).inc(token_count)
+    _child(EMBEDDING_DURATION, model).observe(duration)
+    _inc(EMBEDDING_TOKENS, model, amount=token_count)
 
 def record_vector_store_metrics(operation: str, collection: str, status: str, duration: float):
     """Record vector store metrics"""
-    VECTOR_STORE_OPERATIONS.labels(operation=operation, collection=collection, status=status).inc()
-    VECTOR_STORE_DURATION.labels(operation=operation, collection=collection).observe(duration)
+    _inc(VECTOR_STORE_OPERATIONS, operation, collection, status)
+    _child(VECTOR_STORE_DURATION, operation, collection).observe(duration)
 
 def record_cache_metrics(cache_type: str, hit: bool):
     """Record cache metrics"""
     if hit:
-        CACHE_HITS.labels(cache_type=cache_type).inc()
+        _inc(CACHE_HITS, cache_type)
     else:
-        CACHE_MISSES.labels(cache_type=cache_type).inc()
+        _inc(CACHE_MISSES, cache_type)
 
 def record_error_metrics(error_type: str, component: str):
     """Record error metrics"""
-    ERROR_COUNT.labels(error_type=error_type, component=component).inc()
+    _inc(ERROR_COUNT, error_type, component)
 
 def record_rate_limit_metrics(api_key: str, limit_type: str):
     """Record rate limit metrics"""
-    RATE_LIMIT_HITS.labels(api_key=api_key[:8], limit_type=limit_type).inc()
+    _inc(RATE_LIMIT_HITS, api_key[:8], limit_type)
 
 def record_cost_metrics(model: str, operation: str, cost_usd: float):
     """Record cost metrics"""
-    OPENAI_COST.labels(model=model, operation=operation).inc(cost_usd)
+    _inc(OPENAI_COST, model, operation, amount=cost_usd)
 
 def record_stage_duration(stage: str, collection: str, duration: float):
     """Record stage duration"""
-    STAGE_DURATION.labels(stage=stage, collection=collection).observe(duration)
+    _child(STAGE_DURATION, stage, collection).observe(duration)
 
 def update_active_connections(count: int):
     """Update active connections gauge"""
@@ -218,41 +261,46 @@ def update_active_connections(count: int):
 
 def update_collection_size(collection: str, size: int):
     """Update collection size gauge"""
-    COLLECTION_SIZE.labels(collection=collection).set(size)
+    _child(COLLECTION_SIZE, collection).set(size)
+
+def timing_decorator(metric, *labels):
+    """Decorator for timing function execution
+
+    metric is either a Histogram, whose labelled child is bound once here, or
+    a recorder called as metric(*labels, duration).
+    """
+    if hasattr(metric, 'labels'):
+        record = metric.labels(*labels).observe
+    else:
+        record = partial(metric, *labels)
 
-def timing_decorator(metric_func, *labels):
-    """Decorator for timing function execution"""
     def decorator(func):
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             try:
-                result = await func(*args, **kwargs)
-                duration = time.time() - start_time
-                metric_func(*labels, duration)
-                return result
-            except Exception as e:
-                duration = time.time() - start_time
-                metric_func(*labels, duration)
-                raise
+                return await func(*args, **kwargs)
+            finally:
+                record((time.perf_counter_ns() - start_ns) / 1e9)
         return async_wrapper
     return decorator
 
 class MetricsCollector:
     def __init__(self):
-        self.start_time = time.time()
+        # Monotonic nanosecond timestamps, immune to wall-clock adjustments
+        self.start_time = time.perf_counter_ns()
         self.stage_times = {}
     
     def start_stage(self, stage: str, collection: str = "default"):
         """Start timing a stage"""
         key = f"{stage}:{collection}"
-        self.stage_times[key] = time.time()
+        self.stage_times[key] = time.perf_counter_ns()
     
     def end_stage(self, stage: str, collection: str = "default"):
         """End timing a stage and record metric"""
         key = f"{stage}:{collection}"
         if key in self.stage_times:
-            duration = time.time() - self.stage_times[key]
+            duration = (time.perf_counter_ns() - self.stage_times[key]) / 1e9
             record_stage_duration(stage, collection, duration)
             del self.stage_times[key]
             return duration
@@ -260,7 +308,7 @@ class MetricsCollector:
     
     def get_uptime(self) -> float:
         """Get system uptime in seconds"""
-        return time.time() - self.start_time
+        return (time.perf_counter_ns() - self.start_time) / 1e9
     
     def get_stage_metrics(self) -> Dict[str, Any]:
         """Get current stage metrics"""
@@ -16,6 +16,7 @@ from app.evaluation.ragas_evaluator import EvaluationHarness
 from app.services.query_service import QueryService
 from app.services.ingestion_service import IngestionService
 import structlog
+import uvloop
 
 # Configure logging
 structlog.configure(
@@ -263,4 +264,4 @@ if __name__ == "__main__":
     print("   export OPENAI_API_KEY='your-actual-openai-key'")
     print()
     
-    asyncio.run(main())
+    uvloop.run(main())
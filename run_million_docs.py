@@ -2,7 +2,6 @@
 """
 Script to process 1 million documents with the RAG system
 """
-import asyncio
 import os
 import sys
 import time
@@ -15,6 +14,7 @@ from app.services.massive_ingestion_service import MassiveIngestionService
 from app.services.advanced_query_service import AdvancedQueryService
 from app.utils.dataset_generator import LargeDatasetGenerator
 import structlog
+import uvloop
 
 # Configure logging
 structlog.configure(
@@ -116,4 +116,4 @@ if __name__ == "__main__":
     print("   export OPENAI_API_KEY='your-actual-openai-key'")
     print()
     
-    asyncio.run(main())
+    uvloop.run(main())
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from langchain.schema import Document
+
+from app.core.cache import CacheService
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def setex(self, key, ttl, value):
+        self.ops.append(("setex", key))
+
+    def sadd(self, key, member):
+        self.ops.append(("sadd", key, member))
+
+    def expire(self, key, ttl):
+        self.ops.append(("expire", key))
+
+    def unlink(self, *keys):
+        self.ops.append(("unlink",) + keys)
+
+    async def execute(self):
+        # Yield like a real round trip, so concurrent callers can interleave
+        await asyncio.sleep(0.01)
+        for op in self.ops:
+            self.redis.apply(op)
+        self.redis.log.extend(self.ops)
+        self.ops = []
+
+class FakeRedis:
+    """Just enough of redis.asyncio.Redis for the write queue and invalidation"""
+
+    def __init__(self):
+        self.log = []
+        self.keys = set()
+        self.sets = {}
+
+    def apply(self, op):
+        if op[0] == "setex":
+            self.keys.add(op[1])
+        elif op[0] == "sadd":
+            self.sets.setdefault(op[1], set()).add(op[2])
+        elif op[0] == "unlink":
+            for key in op[1:]:
+                self.keys.discard(key)
+                self.sets.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def sscan_iter(self, key, count=None):
+        for member in list(self.sets.get(key, ())):
+            yield member
+
+@pytest.fixture
+def cache():
+    service = CacheService()
+    service.redis_client = FakeRedis()
+    return service
+
+@pytest.mark.asyncio
+async def test_queued_writes_are_batched(cache):
+    """Writes queued together go out in one pipeline"""
+    for i in range(5):
+        assert cache._enqueue_write(f"k{i}".encode(), 60, b"v", "docs")
+
+    await cache.flush_pending_writes()
+
+    setex_keys = [op[1] for op in cache.redis_client.log if op[0] == "setex"]
+    assert setex_keys == [f"k{i}".encode() for i in range(5)]
+    cache._flusher_task.cancel()
+
+@pytest.mark.asyncio
+async def test_invalidation_waits_for_in_flight_writes(cache):
+    """A write the flusher already dequeued lands before the collection is invalidated"""
+    cache._enqueue_write(b"k0", 60, b"v", "docs")
+    # Let the flusher take the write off the queue; it is now in flight
+    await asyncio.sleep(0)
+    assert cache._write_queue.empty()
+
+    assert await cache.invalidate_collection_cache("docs")
+
+    ops = [op[0] for op in cache.redis_client.log]
+    assert ops.index("setex") < ops.index("unlink")
+    assert b"k0" not in cache.redis_client.keys
+    cache._flusher_task.cancel()
+
+@pytest.mark.asyncio
+async def test_vector_hits_are_isolated_from_callers(cache):
+    """Neither the source document nor a caller's edits can change a cached hit"""
+    doc = Document(page_content="text", metadata={"source": "a.txt"})
+    assert await cache.set_vector_hits("q", "docs", [(doc, 0.9)])
+
+    doc.metadata["source"] = "changed.txt"
+    first = await cache.get_vector_hits("q", "docs")
+    assert first[0]["metadata"]["source"] == "a.txt"
+
+    first[0]["metadata"]["source"] = "edited.txt"
+    first[0]["score"] = 0.0
+    second = await cache.get_vector_hits("q", "docs")
+    assert second[0]["metadata"]["source"] == "a.txt"
+    assert second[0]["score"] == 0.9
+    cache._flusher_task.cancel()
@@ -0,0 +1,138 @@
+import pytest
+import numpy as np
+from langchain.schema import Document
+
+from app.core.deduplication import DeduplicationService, UpsertService, SharedDedupIndex
+from app.core.index_management import IndexManager, ChunkMeta
+
+class FakeVectorStore:
+    """Records what would have been written to the vector store"""
+
+    def __init__(self):
+        self.added = []
+
+    async def add_documents(self, collection_name, documents, embeddings):
+        self.added.extend(documents)
+        return True
+
+class FakeCacheService:
+    async def invalidate_collection_cache(self, collection_name):
+        pass
+
+def make_index_manager() -> IndexManager:
+    """IndexManager wired to in-memory fakes (no vector DB, embedding model or Redis)"""
+    manager = IndexManager.__new__(IndexManager)
+    manager.vector_store = FakeVectorStore()
+    manager.dedup_service = DeduplicationService()
+    manager.cache_service = FakeCacheService()
+    manager.upsert_service = UpsertService(manager.vector_store, manager.dedup_service)
+    manager._background_tasks = set()
+    return manager
+
+def sample_documents():
+    return [
+        {
+            "content": "Machine learning is a subset of artificial intelligence.",
+            "source": "ml.txt",
+            "chunk_index": 0,
+            "metadata": {"author": "test"}
+        },
+        {
+            "content": "Supervised learning uses labelled examples.",
+            "source": "ml.txt",
+            "chunk_index": 1
+        }
+    ]
+
+def test_upsert_record_and_stored_metadata_hash_alike():
+    """The upsert-time record and the metadata stored for it produce the same digest"""
+    dedup = DeduplicationService()
+    doc = sample_documents()[0]
+    chunk_meta = ChunkMeta.from_document(doc, "2024-01-01T00:00:00")
+
+    stored = chunk_meta.to_dict()
+    stored["created_at"] = "2024-06-01T12:00:00"
+    stored["content_hash"] = "00" * 32
+
+    assert dedup.compute_hash(doc["content"], chunk_meta) == dedup.compute_hash(doc["content"], stored)
+
+@pytest.mark.asyncio
+async def test_idempotent_upsert_twice_adds_nothing_new():
+    """Upserting the same documents again is a no-op"""
+    manager = make_index_manager()
+    embeddings = np.random.rand(2, 8).astype(np.float32)
+
+    first = await manager.idempotent_upsert("test", sample_documents(), embeddings)
+    assert first["upserted_documents"] == 2
+
+    second = await manager.idempotent_upsert("test", sample_documents(), embeddings)
+    assert second["success"]
+    assert second["upserted_documents"] == 0
+    assert second["skipped_documents"] == 2
+    assert len(manager.vector_store.added) == 2
+
+@pytest.mark.asyncio
+async def test_upsert_service_ignores_timestamps():
+    """Re-upserting a Document whose only change is created_at is a duplicate"""
+    dedup = DeduplicationService()
+    upsert = UpsertService(FakeVectorStore(), dedup)
+
+    first = Document(page_content="Same text", metadata={"source": "a.txt", "chunk_index": 0,
+                                                         "created_at": "2024-01-01T00:00:00"})
+    again = Document(page_content="Same text", metadata={"source": "a.txt", "chunk_index": 0,
+                                                         "created_at": "2024-02-01T00:00:00"})
+
+    assert (await upsert.upsert_documents("test", [first], [[0.1, 0.2]]))["upserted_documents"] == 1
+    result = await upsert.upsert_documents("test", [again], [[0.1, 0.2]])
+    assert result["upserted_documents"] == 0
+    assert result["duplicate_documents"] == 1
+
+def test_partition_documents_catches_in_batch_duplicates():
+    """The second copy of a chunk within one batch is a duplicate too"""
+    dedup = DeduplicationService()
+    docs = [
+        Document(page_content="Alpha", metadata={"source": "a.txt"}),
+        Document(page_content="alpha!", metadata={"source": "a.txt"}),
+        Document(page_content="Beta", metadata={"source": "a.txt"})
+    ]
+
+    uniques, duplicates = dedup.partition_documents(docs)
+
+    assert [index for index, _, _ in uniques] == [0, 2]
+    assert duplicates == [docs[1]]
+
+@pytest.mark.asyncio
+async def test_upsert_stores_dedup_digest_without_rehashing(monkeypatch):
+    """Each chunk is hashed once; the stored content_hash is that same digest"""
+    manager = make_index_manager()
+    hashed = []
+    compute_hashes = manager.dedup_service.compute_hashes
+    monkeypatch.setattr(manager.dedup_service, "compute_hashes",
+                        lambda contents, metadatas: hashed.extend(contents) or compute_hashes(contents, metadatas))
+    monkeypatch.setattr(manager.dedup_service, "compute_content_hashes",
+                        lambda documents: pytest.fail("documents were hashed again"))
+
+    result = await manager.idempotent_upsert("test", sample_documents(), np.random.rand(2, 8).astype(np.float32))
+
+    assert result["upserted_documents"] == 2
+    assert len(hashed) == 2
+    doc = sample_documents()[0]
+    expected = manager.dedup_service.compute_hash(doc["content"], manager.vector_store.added[0].metadata)
+    assert manager.vector_store.added[0].metadata["content_hash"] == expected.hex()
+
+def test_shared_dedup_index_round_trip(tmp_path):
+    """SharedDedupIndex behaves like the in-process dict and persists across instances"""
+    index = SharedDedupIndex(str(tmp_path / "dedup.db"))
+    index.update([(b"h1", "doc-1"), (b"h2", "doc-2")])
+    index[b"h3"] = "doc-3"
+
+    assert len(index) == 3
+    assert b"h1" in index
+    assert index.get_many([b"h1", b"h3", b"missing"]) == {b"h1": "doc-1", b"h3": "doc-3"}
+    assert index.pop(b"h2") == "doc-2"
+    assert index.pop(b"h2", "gone") == "gone"
+    assert index.delete_many([b"h3", b"missing"]) == 1
+
+    reopened = SharedDedupIndex(str(tmp_path / "dedup.db"))
+    assert reopened.get(b"h1") == "doc-1"
+    assert len(reopened) == 1
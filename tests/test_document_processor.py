@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+import tiktoken
+from langchain.schema import Document
+
+from app.core import document_processor
+from app.core.document_processor import DocumentProcessor
+
+# One token per byte, built locally so the tests need no BPE download; multibyte
+# characters span several tokens, like rare characters do in cl100k_base
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={}
+)
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setattr(document_processor, "_get_encoding", lambda name: BYTE_ENCODING)
+    return DocumentProcessor(chunk_size_tokens=20, chunk_overlap_tokens=5)
+
+def test_split_tokens_respects_size_and_word_boundaries(processor):
+    """Windows stay within the token budget and never cut a word"""
+    words = [f"word{i}" for i in range(200)]
+    chunks, token_counts = processor._split_tokens(" ".join(words))
+
+    assert len(chunks) > 1
+    assert max(token_counts) <= 20
+    vocabulary = set(words)
+    assert all(set(chunk.split()) <= vocabulary for chunk in chunks)
+    # Consecutive windows overlap
+    assert chunks[0].split()[-1] in chunks[1].split()
+
+def test_split_tokens_keeps_multibyte_text_intact(processor):
+    """Text without whitespace is cut on character boundaries (no U+FFFD)"""
+    processor.chunk_overlap_tokens = 0
+    text = "日本語のテキストはトークン境界で分割されることがあります。" * 4 + " naïve café résumé" * 5
+    chunks, _ = processor._split_tokens(text)
+
+    assert len(chunks) > 1
+    assert all("�" not in chunk for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") == text.replace(" ", "")
+
+@pytest.mark.parametrize("size,overlap", [(4, 3), (5, 4), (7, 5), (20, 5)])
+def test_split_tokens_never_exceeds_budget_on_character_cuts(processor, size, overlap):
+    """Cutting on character boundaries shortens the overlap, never grows the window"""
+    processor.chunk_size_tokens = size
+    processor.chunk_overlap_tokens = overlap
+    text = "aé日😀" * 20
+    chunks, token_counts = processor._split_tokens(text)
+
+    assert max(token_counts) <= size
+    assert all("�" not in chunk for chunk in chunks)
+    assert "".join(chunks).startswith("aé日😀")
+
+def test_split_tokens_counts_tokens_after_strip(processor):
+    """Reported counts match the stored (stripped) chunk text"""
+    text = " ".join(f"token{i}" for i in range(100)) + "   \n"
+    chunks, token_counts = processor._split_tokens(text)
+
+    assert token_counts == [len(BYTE_ENCODING.encode_ordinary(chunk)) for chunk in chunks]
+
+def test_split_tokens_without_overlap_partitions_text(processor):
+    """With no overlap the windows reassemble to the original words"""
+    processor.chunk_overlap_tokens = 0
+    text = " ".join(f"token{i}" for i in range(100))
+    chunks, _ = processor._split_tokens(text)
+
+    assert " ".join(chunks).split() == text.split()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("failing_stage", ["chunk", "embed"])
+async def test_process_and_embed_fails_fast_with_full_queues(processor, failing_stage):
+    """A failed stage tears the pipeline down even while the queues are full"""
+    calls = 0
+
+    async def load_file(path):
+        return "text", {"source": path, "file_type": ".txt"}
+
+    def split_text(text, metadata):
+        nonlocal calls
+        calls += 1
+        if failing_stage == "chunk" and calls == 5:
+            raise RuntimeError("chunking failed")
+        return [Document(page_content=text, metadata=metadata)]
+
+    async def embed_documents(batch):
+        # Give the parse and chunk stages time to fill both queues
+        await asyncio.sleep(0.05)
+        if failing_stage == "embed":
+            raise RuntimeError("embedding backend down")
+        return batch
+
+    processor._load_file = load_file
+    processor._split_text = split_text
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(
+            processor.process_and_embed([f"f{i}.txt" for i in range(50)], embed_documents,
+                                        embed_batch_size=1, embed_concurrency=1),
+            timeout=2
+        )
@@ -0,0 +1,39 @@
+import numpy as np
+
+from app.core.embedding_cache import EmbeddingCache, NearDuplicateEmbeddingCache, simhash64
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def test_embedding_cache_round_trip(tmp_path):
+    """Vectors come back as float32 values, keyed by both hash and model"""
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    cache.write_many([(b"h1", [0.1, 0.2]), (b"h2", [0.3, 0.4])], "model-a")
+    cache.write(b"h1", "model-b", [1.0, 2.0])
+
+    found = cache.lookup([b"h1", b"h2", b"h3"], "model-a")
+    assert set(found) == {b"h1", b"h2"}
+    assert np.allclose(found[b"h1"], [0.1, 0.2])
+    assert cache.lookup([b"h1"], "model-b") == {b"h1": [1.0, 2.0]}
+    cache.close()
+
+def test_simhash64_is_close_for_near_duplicates():
+    """Small edits move the fingerprint a few bits; unrelated text moves it many"""
+    text = "The quick brown fox jumps over the lazy dog near the quiet river bank today"
+    assert simhash64(text) == simhash64(text.upper())
+    assert hamming(simhash64(text), simhash64(text + " again")) <= 8
+    assert hamming(simhash64(text), simhash64("Completely unrelated words about databases and caching")) > 8
+
+def test_near_duplicate_cache_lookup_and_eviction():
+    """Near-identical text reuses a vector until its slot is overwritten"""
+    cache = NearDuplicateEmbeddingCache(max_entries=2, max_distance=3)
+    text = "Embeddings for this chunk were computed once and can be reused"
+    cache.add(text, [1.0])
+
+    assert cache.lookup(text + "!") == [1.0]
+    assert cache.lookup("An entirely different paragraph on another subject") is None
+
+    # Oldest entries are overwritten once the ring is full
+    cache.add("second chunk of text", [2.0])
+    cache.add("third chunk of text entirely", [3.0])
+    assert cache.lookup(text) is None
@@ -0,0 +1,56 @@
+import pytest
+import numpy as np
+from langchain.schema import Document
+
+from app.core.hybrid_search import HybridSearchEngine
+
+@pytest.fixture
+def engine():
+    """Engine without an Elasticsearch connection (blend is pure computation)"""
+    return HybridSearchEngine.__new__(HybridSearchEngine)
+
+def chunk(source: str, chunk_index) -> Document:
+    return Document(page_content=f"{source} #{chunk_index}",
+                    metadata={"source": source, "chunk_index": chunk_index})
+
+@pytest.mark.asyncio
+async def test_blend_ranks_by_weighted_scores(engine):
+    """Hybrid score is the weighted sum of min-max normalized scores"""
+    vector_results = [(chunk("a", 0), 0.9), (chunk("b", 0), 0.5), (chunk("c", 0), 0.1)]
+    bm25_results = [({"source": "c", "chunk_index": 0}, 10.0), ({"source": "a", "chunk_index": 0}, 0.0)]
+
+    results = await engine.blend("q", vector_results, bm25_results, top_k=3,
+                                 semantic_weight=0.7, keyword_weight=0.3)
+
+    assert [doc.metadata["source"] for doc, _ in results] == ["a", "b", "c"]
+    assert [score for _, score in results] == pytest.approx([0.7, 0.35, 0.3])
+
+@pytest.mark.asyncio
+async def test_blend_collapses_duplicate_ids(engine):
+    """A document returned twice keeps one slot with its best score"""
+    vector_results = [(chunk("a", 1), 1.0), (chunk("a", 1), 0.2), (chunk("b", 2), 0.0)]
+    bm25_results = [({"source": "a", "chunk_index": "1"}, 4.0), ({"source": "d", "chunk_index": 0}, 2.0)]
+
+    results = await engine.blend("q", vector_results, bm25_results, top_k=10)
+
+    ids = [engine._get_doc_id(doc) for doc, _ in results]
+    assert len(ids) == len(set(ids)) == 3
+    assert ids[0] == ("a", 1)
+    assert results[0][1] == pytest.approx(1.0)
+
+@pytest.mark.asyncio
+async def test_blend_without_bm25_returns_vector_results(engine):
+    """With no BM25 hits the vector results pass through unchanged"""
+    vector_results = [(chunk("a", 0), 0.9), (chunk("b", 0), 0.5)]
+    assert await engine.blend("q", vector_results, [], top_k=1) == vector_results[:1]
+
+def test_doc_id_normalizes_chunk_index(engine):
+    """3 and "3" identify the same chunk"""
+    assert engine._get_doc_id(chunk("a", 3)) == engine._get_doc_id({"source": "a", "chunk_index": "3"})
+
+def test_top_k_indices_order():
+    """Indices of the k best scores, best first"""
+    scores = np.array([0.1, 0.9, 0.5, 0.7])
+    assert HybridSearchEngine._top_k_indices(scores, 2).tolist() == [1, 3]
+    assert HybridSearchEngine._top_k_indices(scores, 10).tolist() == [1, 3, 2, 0]
+    assert HybridSearchEngine._top_k_indices(scores, 0).tolist() == []
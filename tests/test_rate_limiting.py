@@ -0,0 +1,102 @@
+import time
+import pytest
+
+from app.core.rate_limiting import RequestLog, RateLimiter, RateLimitConfig, APIKeyQuota, TokenBucket
+
+def test_request_log_grows_and_counts_windows():
+    """Appends past capacity keep every timestamp, in order"""
+    log = RequestLog(capacity=4)
+    for t in range(10):
+        log.append(float(t))
+
+    assert len(log) == 10
+    assert log.live().tolist() == [float(t) for t in range(10)]
+
+    # Newer than 6.5: 7, 8, 9 (oldest 7); newer than 100: none
+    assert log.counts_after((6.5, 100.0)) == [(3, 7.0), (0, 0.0)]
+
+def test_request_log_evicts_and_compacts():
+    """Evicted timestamps are gone, and the freed space is reused before growing"""
+    log = RequestLog(capacity=4)
+    for t in range(4):
+        log.append(float(t))
+    log.evict_before(3.0)
+    assert log.live().tolist() == [3.0]
+
+    log.append(4.0)
+    assert len(log.ts) == 4
+    assert log.live().tolist() == [3.0, 4.0]
+
+@pytest.mark.asyncio
+async def test_burst_limit_window():
+    """More than burst_limit requests in 10 seconds are refused until the window moves"""
+    limiter = RateLimiter(RateLimitConfig(requests_per_minute=100, burst_limit=3, concurrent_requests=100))
+    for t in (0.0, 1.0, 2.0):
+        assert (await limiter.check_rate_limit("key", now=t))["allowed"]
+        await limiter.record_request("key", now=t)
+
+    refused = await limiter.check_rate_limit("key", now=3.0)
+    assert not refused["allowed"]
+    assert refused["reason"] == "Burst limit exceeded"
+    assert refused["retry_after"] == pytest.approx(7.0)
+
+    # The first request leaves the burst window after 10 seconds
+    assert (await limiter.check_rate_limit("key", now=10.5))["allowed"]
+
+@pytest.mark.asyncio
+async def test_minute_limit_window():
+    """Requests per minute are counted over a sliding 60-second window"""
+    limiter = RateLimiter(RateLimitConfig(requests_per_minute=5, burst_limit=100, concurrent_requests=100))
+    for t in range(5):
+        await limiter.record_request("key", now=t * 5.0)
+
+    refused = await limiter.check_rate_limit("key", now=30.0)
+    assert not refused["allowed"]
+    assert refused["reason"] == "Rate limit exceeded (per minute)"
+    assert refused["retry_after"] == pytest.approx(30.0)
+
+    assert (await limiter.check_rate_limit("key", now=60.5))["allowed"]
+
+@pytest.mark.asyncio
+async def test_cleanup_drops_expired_keys():
+    """Cleanup evicts hour-old requests and stops tracking keys left empty"""
+    limiter = RateLimiter()
+    limiter.last_cleanup = 0.0
+    await limiter.record_request("old", now=0.0)
+    await limiter.record_request("fresh", now=3500.0)
+
+    await limiter.check_rate_limit("other", now=4000.0)
+
+    assert "old" not in limiter.request_tracking
+    assert "fresh" in limiter.request_tracking
+    assert [key for _, key in limiter._expiry_heap] == ["fresh"]
+
+@pytest.mark.asyncio
+async def test_concurrency_totals():
+    """Running totals follow quota changes, records and releases"""
+    limiter = RateLimiter()
+    limiter.add_api_key_quota(APIKeyQuota("a" * 16, 100, 1000, 4, 20, ["query"]))
+    limiter.add_api_key_quota(APIKeyQuota("b" * 16, 100, 1000, 6, 20, ["query"]))
+    limiter.add_api_key_quota(APIKeyQuota("b" * 16, 100, 1000, 2, 20, ["query"]))
+
+    await limiter.record_request("a" * 16, now=0.0)
+    await limiter.record_request("a" * 16, now=1.0)
+    await limiter.release_request("a" * 16)
+    await limiter.release_request("b" * 16)
+
+    assert limiter.get_totals() == (1, 6)
+
+    limiter.remove_api_key_quota("a" * 16)
+    assert limiter.get_totals() == (1, 2)
+
+@pytest.mark.asyncio
+async def test_token_bucket_paces_after_capacity():
+    """The bucket serves its capacity at once, then waits for refill"""
+    bucket = TokenBucket(tokens_per_minute=600, capacity=10)  # 10 tokens per second
+
+    start = time.monotonic()
+    await bucket.acquire(10)
+    assert time.monotonic() - start < 0.05
+
+    await bucket.acquire(2)
+    assert time.monotonic() - start >= 0.15